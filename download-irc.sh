@@ -1,8 +1,24 @@
 #!/usr/bin/env bash
+set -e
+
+# Release point to download, e.g. ./download-irc.sh 114 329not328
+CONGRESS=${1:-114}
+LAW=${2:-329not328}
 
 mkdir -p irc/xml
 cd irc/xml
-curl http://uscode.house.gov/download/releasepoints/us/pl/114/329not328/xml_usc26@114-329not328.zip -o irc.zip
-unzip irc.zip
-rm irc.zip
-mv usc26.xml irc.xml
\ No newline at end of file
+# Downloaded and extracted aside first, so a failed download leaves irc.xml (and irc-previous.xml) as they were
+rm -rf irc-download
+mkdir irc-download
+trap 'rm -rf irc-download' EXIT
+curl -f http://uscode.house.gov/download/releasepoints/us/pl/${CONGRESS}/${LAW}/xml_usc26@${CONGRESS}-${LAW}.zip -o irc-download/irc.zip
+unzip irc-download/irc.zip -d irc-download
+if [ ! -f irc-download/usc26.xml ]; then
+    echo "The downloaded archive has no usc26.xml, irc.xml was not changed." >&2
+    exit 1
+fi
+# Keep the previous release point, to find the sections that changed (see scripts/release_diff.py)
+if [ -f irc.xml ]; then
+    mv irc.xml irc-previous.xml
+fi
+mv irc-download/usc26.xml irc.xml
@@ -11,16 +11,57 @@ class AMRCodecNoInvert(penman.AMRCodec):
 CODEC = AMRCodecNoInvert
 
 
-def read_from_file(filepath, graph=False):
-    graphs = penman.load(filepath, cls=CODEC)
-    if graph:
-        return graphs
-    codec = CODEC()
-    amrs = []
-    for g in graphs:
-        amr = codec.encode(g)
-        amrs.append(amr)
-    return amrs
+def _paren_depth(line):
+    # Change in parenthesis depth over a line of PENMAN, ignoring quoted strings and comments
+    if line.lstrip().startswith("#"):
+        return 0
+    if '"' not in line:
+        return line.count("(") - line.count(")")
+    depth = 0
+    quoted = False
+    escaped = False
+    for c in line:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == '"':
+            quoted = not quoted
+        elif not quoted and c == "(":
+            depth += 1
+        elif not quoted and c == ")":
+            depth -= 1
+    return depth
 
+def iterate_blocks(lines):
+    # Blank-line separated blocks of complete graphs (with their comments), as parser outputs are written
+    block = []
+    depth = 0
+    for line in lines:
+        if line.strip() == "" and depth <= 0:
+            if len(block) > 0:
+                yield "".join(block)
+            block = []
+            depth = 0
+            continue
+        block.append(line)
+        depth += _paren_depth(line)
+    if len(block) > 0:
+        yield "".join(block)
 
+def iterate_from_file(filepath, graph=False):
+    """
+    Reads the AMRs of a file one block at a time, yielding each as a penman Graph if graph is True and as a
+    PENMAN string otherwise, so memory use does not grow with the file.
+    """
+    codec = CODEC()
+    with open(filepath, 'r') as f:
+        for block in iterate_blocks(f):
+            for g in codec.iterdecode(block):
+                if graph:
+                    yield g
+                else:
+                    yield codec.encode(g)
 
+def read_from_file(filepath, graph=False):
+    return list(iterate_from_file(filepath, graph=graph))
@@ -0,0 +1,143 @@
+import json
+import math
+import threading
+import time
+import candc_boxer_api
+import candc_boxer_server
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if len(sorted_values) == 0:
+        return float('nan')
+    rank = int(math.ceil(p/100.0*len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+def make_sentences(num_sentences):
+    return [u"The taxpayer shall pay a tax of {0} percent on the income of the year.".format(i) for i in xrange(num_sentences)]
+
+def load_sentences(sentences_filepath):
+    with open(sentences_filepath, 'r') as f:
+        return [line.decode("UTF-8").strip() for line in f if line.strip() != ""]
+
+def run(host, port, sentences, concurrency, batch_size, policy=None):
+    """
+    Interprets the sentences with a new client (without the response cache), one sentence per request if batch_size
+    is 1 and in adaptive batches of up to batch_size sentences otherwise. Returns the elapsed seconds, the
+    latency of each request and the number of sentences that failed.
+    """
+    ccboxer = candc_boxer_api.CCBoxerAPI(host, port, concurrency=concurrency, cache_dir=None, max_batch_size=batch_size, policy=policy)
+    latencies = []
+    send_request = ccboxer._send_request
+    def timed_send_request(*args, **kwargs):
+        start = time.time()
+        try:
+            return send_request(*args, **kwargs)
+        finally:
+            latencies.append(time.time() - start)
+    ccboxer._send_request = timed_send_request
+    start = time.time()
+    if batch_size > 1:
+        results = ccboxer.interpret_batched(sentences)
+    else:
+        results = ccboxer.interpret_many(sentences)
+    elapsed = time.time() - start
+    ccboxer.close()
+    failures = sum(1 for result in results if isinstance(result, candc_boxer_api.CCBoxerAPIException))
+    return elapsed, latencies, failures
+
+def record(host, port, sentences, recordings_filepath):
+    # Prolog output of each sentence on its own, for the stand-in server to replay
+    ccboxer = candc_boxer_api.CCBoxerAPI(host, port, cache_dir=None)
+    options = {"instantiate": "true", "format": "prolog"}
+    recordings = dict()
+    for sentence in sentences:
+        try:
+            recordings[sentence] = ccboxer._get_response(sentence, options)["out"]
+        except candc_boxer_api.CCBoxerAPIException:
+            continue
+    with open(recordings_filepath, 'w') as f:
+        json.dump(recordings, f, indent=4, sort_keys=True)
+    print("Recorded {0} of {1} sentences.".format(len(recordings), len(sentences)))
+
+
+def main(args):
+    if args.sentences_filepath is not None:
+        sentences = load_sentences(args.sentences_filepath)
+    else:
+        sentences = make_sentences(args.num_sentences)
+
+    if args.record is not None:
+        record(args.host, args.port, sentences, args.record)
+        return
+
+    if args.start_server:
+        server = candc_boxer_server.StandInServer((args.host, args.port),
+                                                  recordings=candc_boxer_server.load_recordings(args.recordings_filepath),
+                                                  latency=args.latency,
+                                                  latency_per_sentence=args.latency_per_sentence,
+                                                  error_rate=args.error_rate,
+                                                  crash_rate=args.crash_rate,
+                                                  crash_words=args.crash_words,
+                                                  seed=0)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+    print("{0:>11} {1:>5} {2:>8} {3:>8} {4:>8} {5:>12} {6:>8} {7:>8} {8:>8}".format(
+        "concurrency", "batch", "requests", "failed", "seconds", "sentences/s", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+    for concurrency in args.concurrency:
+        for batch_size in args.batch_sizes:
+            policy = candc_boxer_api.CCBoxerCallPolicy(timeout=args.timeout, retries=args.retries, hedge_after=args.hedge_after)
+            elapsed, latencies, failures = run(args.host, args.port, sentences, concurrency, batch_size, policy)
+            latencies.sort()
+            print("{0:>11} {1:>5} {2:>8} {3:>8} {4:>8.2f} {5:>12.1f} {6:>8.1f} {7:>8.1f} {8:>8.1f}".format(
+                concurrency, batch_size, len(latencies), failures, elapsed, len(sentences)/elapsed,
+                1000*percentile(latencies, 50), 1000*percentile(latencies, 95), 1000*percentile(latencies, 99)))
+
+    if args.start_server:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Measure the throughput and request latency of CCBoxerAPI against a C&C/Boxer server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--sentences-filepath",
+                        type=str,
+                        default=None,
+                        help="File with one sentence per line. Defaults to generated sentences.")
+    parser.add_argument("--num-sentences",
+                        type=int,
+                        default=200,
+                        help="Number of generated sentences.")
+    parser.add_argument("--concurrency",
+                        type=int,
+                        nargs="+",
+                        default=[1, 4, 16],
+                        help="Maximum requests in flight, one run per value.")
+    parser.add_argument("--batch-sizes",
+                        type=int,
+                        nargs="+",
+                        default=[1, 8, 32],
+                        help="Maximum sentences per request (1 for no batching), one run per value.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds before a request is abandoned (and retried).")
+    parser.add_argument("--retries", type=int, default=2, help="Retries of requests failing with transient errors.")
+    parser.add_argument("--hedge-after", type=float, default=None, help="Seconds after which a duplicate of an unanswered request is sent.")
+    parser.add_argument("--record",
+                        type=str,
+                        default=None,
+                        help="Instead of measuring, record the output of each sentence from the server to this JSON file.")
+    parser.add_argument("--start-server",
+                        action="store_true",
+                        help="Run the local stand-in server (see candc_boxer_server.py) on host and port during the test.")
+    parser.add_argument("--recordings-filepath", type=str, default=None)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-per-sentence", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--crash-rate", type=float, default=0.0)
+    parser.add_argument("--crash-words", type=int, default=None)
+    args = parser.parse_args()
+    main(args)
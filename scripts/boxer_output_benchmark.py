@@ -0,0 +1,92 @@
+import timeit
+import candc_boxer_api
+
+
+def make_boxer_output(num_sentences, words_per_sentence):
+    # Prolog output in the form C&C/Boxer returns, with one id/sem record per sentence
+    lines = []
+    for i in xrange(1, num_sentences + 1):
+        words = []
+        conditions = []
+        for j in xrange(1, words_per_sentence + 1):
+            token_id = 1000*i + j
+            words.append("{0}:[tok:'word{1}',pos:'NN',lemma:word{1},namex:'O']".format(token_id, j))
+            conditions.append("[{0}]:pred(x{1},word{1},n,0)".format(token_id, j))
+        referents = ",".join("[]:x{0}".format(j) for j in xrange(1, words_per_sentence + 1))
+        lines.append("id({0},{0}).".format(i))
+        lines.append("sem({0},[{1}],drs([{2}],[{3}])).".format(i, ",".join(words), referents, ",".join(conditions)))
+    return "\n".join(lines) + "\n"
+
+### Previous implementation of CCBoxerAPI._parse_to_drs_dict, finding records only
+def split_drs_records(boxer_out):
+    records = []
+    lines = boxer_out.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('id('):
+            comma_idx = line.index(',')
+            discourse_id = line[3:comma_idx]
+            if discourse_id[0] == "'" and discourse_id[-1] == "'":
+                discourse_id = discourse_id[1:-1]
+            drs_id = line[comma_idx+1:line.index(')')]
+            i += 1
+            line = lines[i]
+            assert line.startswith('sem({0},'.format(drs_id))
+            if line[-4:] == "').'":
+                line = line[:-4] + ")."
+            assert line.endswith(').'), "can't parse line: {0}".format(line)
+
+            search_start = len('sem({0},['.format(drs_id))
+            brace_count = 1
+            drs_start = -1
+            for j,c in enumerate(line[search_start:]):
+                if(c == '['):
+                    brace_count += 1
+                if(c == ']'):
+                    brace_count -= 1
+                    if(brace_count == 0):
+                        drs_start = search_start + j + 1
+                        if line[drs_start:drs_start+3] == "','":
+                            drs_start = drs_start + 3
+                        else:
+                            drs_start = drs_start + 1
+                        break
+            assert drs_start > -1
+
+            records.append((discourse_id, line[drs_start:-2].strip()))
+        i += 1
+    return records
+
+def benchmark(num_sentences, words_per_sentence, repeat):
+    boxer_out = make_boxer_output(num_sentences, words_per_sentence)
+    assert split_drs_records(boxer_out) == list(candc_boxer_api.iterate_drs_records(boxer_out))
+    lines_time = min(timeit.repeat(lambda: split_drs_records(boxer_out), number=1, repeat=repeat))
+    stream_time = min(timeit.repeat(lambda: list(candc_boxer_api.iterate_drs_records(boxer_out)), number=1, repeat=repeat))
+    return len(boxer_out), lines_time, stream_time
+
+
+def main(args):
+    print("{0:>10} {1:>6} {2:>10} {3:>12} {4:>12} {5:>8}".format("sentences", "words", "bytes", "lines (ms)", "stream (ms)", "speedup"))
+    for num_sentences in args.sentences:
+        size, lines_time, stream_time = benchmark(num_sentences, args.words, args.repeat)
+        print("{0:>10} {1:>6} {2:>10} {3:>12.2f} {4:>12.2f} {5:>7.1f}x".format(num_sentences, args.words, size, 1000*lines_time, 1000*stream_time, lines_time/stream_time))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare finding DRS records in C&C/Boxer output line by line (previous implementation) and with the streaming parser.")
+    parser.add_argument("--sentences",
+                        type=int,
+                        nargs="+",
+                        default=[10, 100, 1000],
+                        help="Numbers of sentences in the generated outputs.")
+    parser.add_argument("--words",
+                        type=int,
+                        default=40,
+                        help="Number of words per sentence.")
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=5)
+    args = parser.parse_args()
+    main(args)
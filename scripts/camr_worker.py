@@ -0,0 +1,80 @@
+import os
+from os.path import join
+import json
+import runpy
+import sys
+import traceback
+
+
+def memoize(func):
+    # Later calls with the same arguments return the result of the first
+    results = dict()
+    def memoized(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        if key not in results:
+            results[key] = func(*args, **kwargs)
+        return results[key]
+    return memoized
+
+def load_model_once(model_filepath):
+    # CAMR loads its model on every parse; later loads of the same file return the model loaded here
+    import model
+    model.Model.load_model = staticmethod(memoize(model.Model.load_model))
+    model.Model.load_model(model_filepath)
+
+def keep_preprocessing_loaded():
+    # CAMR's preprocessing starts Stanford CoreNLP (a JVM) and loads the Charniak parser (BLLIP) for every file,
+    # and BLLIP can only be loaded once per process. Both are started on the first request and kept for later ones.
+    import preprocessing
+    preprocessing.StanfordCoreNLP = memoize(preprocessing.StanfordCoreNLP)
+    try:
+        from bllipparser import RerankingParser
+    except ImportError:
+        # Only needed with the Charniak dependency parser
+        return
+    RerankingParser.from_unified_model_dir = staticmethod(memoize(RerankingParser.from_unified_model_dir))
+
+def run_camr(camr_dir, argv):
+    # Runs amr_parsing.py in this process, as if from the command line
+    sys.argv = [join(camr_dir, "amr_parsing.py")] + argv
+    try:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+    except SystemExit, e:
+        if e.code not in [None, 0]:
+            raise Exception("amr_parsing.py exited with {0}".format(e.code))
+
+def parse_file(camr_dir, model_filepath, input_filepath):
+    run_camr(camr_dir, ["-m", "preprocess", input_filepath])
+    run_camr(camr_dir, ["-m", "parse", "--model", model_filepath, input_filepath])
+    model_name = os.path.basename(model_filepath).split(".")[-2]
+    return "{0}.all.{1}.parsed".format(input_filepath, model_name)
+
+
+def main(args):
+    sys.path.insert(0, args.camr_dir)
+    os.chdir(args.camr_dir)
+    # Responses go to the original stdout, anything CAMR (or its subprocesses) prints goes to stderr
+    responses = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    load_model_once(args.model)
+    keep_preprocessing_loaded()
+    responses.write(json.dumps({"ready": True}) + "\n")
+    responses.flush()
+    for line in iter(sys.stdin.readline, ""):
+        request = json.loads(line)
+        try:
+            response = {"output_filepath": parse_file(args.camr_dir, args.model, request["input_filepath"])}
+        except Exception:
+            response = {"error": traceback.format_exc()}
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Long-lived CAMR process, which loads the model (and the preprocessing parsers) once and then parses the sentence file " + \
+                                                 "of each request. Requests and responses are lines of JSON on stdin and stdout.")
+    parser.add_argument("--camr-dir", type=str, required=True)
+    parser.add_argument("--model", type=str, required=True)
+    args = parser.parse_args()
+    main(args)
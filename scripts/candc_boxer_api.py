@@ -1,88 +1,459 @@
+from os.path import dirname, join, realpath
+import re
+import random
+import threading
+import time
+import Queue
 import requests
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
 import nltk
 from nltk.sem.boxer import BoxerOutputDrsParser, NltkDrtBoxerDrsInterpreter
+from response_cache import ResponseCache, cache_key
+
+
+CACHE_DIR = join(dirname(dirname(realpath(__file__))), "cache/candc_boxer")
+ID_LINE_REGEX = re.compile(r"id\(([^,\n]*),([^)\n]*)\)")
+BRACKET_REGEX = re.compile(r"[\[\]]")
+# A list with lists nested in it, but no deeper, such as the words of a sentence
+NESTED_LIST_REGEX = re.compile(r"\[(?:[^\[\]]*\[[^\[\]]*\])*[^\[\]]*\]")
+# Errors that may not happen again, so are not remembered in the cache
+TRANSIENT_STATUS_CODES = [502, 503, 504]
+INTERPRET_OPTIONS = {"instantiate": "true", "format": "prolog"}
+# Errors from parsing Boxer's output, e.g. a malformed or truncated response
+PARSE_ERRORS = (nltk.sem.logic.LogicalExpressionException, AssertionError, ValueError, IndexError, KeyError)
+
+
+def _iterate_line_starts(text, prefix):
+    # Start of each line beginning with prefix
+    if text.startswith(prefix):
+        yield 0
+    position = text.find('\n' + prefix)
+    while position != -1:
+        yield position + 1
+        position = text.find('\n' + prefix, position + 1)
+
+def _find_list_end(text, start, end):
+    # Position after the bracket closing the list opening at start, counting brackets as Boxer's parser does
+    m = NESTED_LIST_REGEX.match(text, start, end)
+    if m is not None:
+        return m.end()
+    # Lists nested more deeply, or not closed
+    brace_count = 1
+    for bracket in BRACKET_REGEX.finditer(text, start + 1, end):
+        if bracket.group() == '[':
+            brace_count += 1
+        else:
+            brace_count -= 1
+            if brace_count == 0:
+                return bracket.end()
+    return -1
+
+def _iterate_record_lines(boxer_out):
+    # (discourse id, DRS id, start of the id line, start and end of the sem line) of each record
+    for line_start in _iterate_line_starts(boxer_out, "id("):
+        m = ID_LINE_REGEX.match(boxer_out, line_start)
+        assert m is not None, "can't parse line: {0}".format(boxer_out[line_start:boxer_out.find('\n', line_start)])
+        discourse_id = m.group(1)
+        if discourse_id[0] == "'" and discourse_id[-1] == "'":
+            discourse_id = discourse_id[1:-1]
+        sem_start = boxer_out.find('\n', m.start())
+        assert sem_start != -1, "missing sem line for id: {0}".format(discourse_id)
+        sem_start += 1
+        sem_end = boxer_out.find('\n', sem_start)
+        if sem_end == -1:
+            sem_end = len(boxer_out)
+        yield discourse_id, m.group(2), line_start, sem_start, sem_end
+
+def iterate_records(boxer_out):
+    # (discourse id, id line and sem line) of each record in Boxer's Prolog output, e.g. to store the sentences of a batch
+    for discourse_id, _, line_start, _, sem_end in _iterate_record_lines(boxer_out):
+        yield discourse_id, boxer_out[line_start:sem_end]
+
+### Based on https://github.com/nltk/nltk/blob/develop/nltk/sem/boxer.py
+def iterate_drs_records(boxer_out):
+    """
+    Yields (discourse id, DRS string) for each id(...) line and the sem(...) line after it in Boxer's Prolog
+    output, finding lines and brackets with regexes over the whole output instead of splitting it into lines.
+    """
+    for discourse_id, drs_id, _, sem_start, sem_end in _iterate_record_lines(boxer_out):
+        sem_prefix = 'sem({0},'.format(drs_id)
+        assert boxer_out.startswith(sem_prefix, sem_start)
+        if boxer_out.endswith("').'", sem_start, sem_end):
+            drs_end = sem_end - 4
+        else:
+            assert boxer_out.endswith(').', sem_start, sem_end), "can't parse line: {0}".format(boxer_out[sem_start:sem_end])
+            drs_end = sem_end - 2
+        # The DRS follows the list of words, after the bracket closing it
+        drs_start = _find_list_end(boxer_out, sem_start + len(sem_prefix), sem_end)
+        if drs_start > -1:
+            if boxer_out.startswith("','", drs_start):
+                drs_start += 3
+            else:
+                drs_start += 1
+        assert drs_start > -1
+        yield discourse_id, boxer_out[drs_start:drs_end].strip()
 
 
 class CCBoxerAPIException(Exception):
     pass
 
+class CCBoxerServerException(CCBoxerAPIException):
+    # The server failed on the input, e.g. C&C/Boxer crashed
+    def __init__(self, message, status_code):
+        super(CCBoxerServerException, self).__init__(message)
+        self.status_code = status_code
+
+class CCBoxerUnavailableException(CCBoxerAPIException):
+    # The server could not be reached in time, or is failing (e.g. the circuit breaker is open)
+    pass
+
+class CCBoxerCacheMissException(CCBoxerAPIException):
+    # In offline mode, the response is not in the cache
+    pass
+
+
+class CCBoxerCallPolicy(object):
+    """
+    How CCBoxerAPI calls the server. Each attempt times out after timeout seconds, and a call (with all its
+    attempts) after deadline seconds. Transient errors (timeouts, connection errors, 502/503/504) are retried
+    up to retries times, after a random delay of up to backoff*2^(attempt-1) seconds (at most max_backoff).
+    If hedge_after is given, a duplicate request is sent when an attempt has not been answered after that many
+    seconds, and the first answer is used. After failure_threshold calls in a row fail with transient errors,
+    calls fail immediately for reset_timeout seconds, after which a single call is let through to try again.
+    """
+    def __init__(self, timeout=60.0, deadline=300.0, retries=2, backoff=1.0, max_backoff=10.0, hedge_after=None,
+                 failure_threshold=5, reset_timeout=60.0):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            # Half-open, one call at a time finds out if the server has recovered
+            if not self._trial and time.time() - self._opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+            self._trial = False
+
+
 class CCBoxerAPI(object):
-    def __init__(self, ip_address="128.52.170.142", port=8888):
+    def __init__(self, ip_address="128.52.170.142", port=8888, concurrency=8,
+                 cache_dir=CACHE_DIR, cache_max_bytes=512 << 20, offline=False, server_tag=None,
+                 max_batch_size=64, max_batch_tokens=2000, policy=None):
         self._base_url = "http://{0}:{1}/json/pipeline".format(ip_address, port)
+        # Timeouts, retries, hedging and circuit breaking of calls to the server
+        self.policy = policy if policy is not None else CCBoxerCallPolicy()
+        self._breaker = CircuitBreaker(self.policy.failure_threshold, self.policy.reset_timeout)
+        # Responses (and server errors) are cached on disk by server tag, options and payload, unless cache_dir is None
+        self._cache = ResponseCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir is not None else None
+        # Identifies the server (and its version) in cache keys, defaults to its URL
+        self.server_tag = server_tag if server_tag is not None else self._base_url
+        # In offline mode, only cached responses are used
+        self.offline = offline
+        # Maximum number of requests in flight in interpret_many
+        self.concurrency = concurrency
+        # Sentences and tokens per request in interpret_batched, learned up to the maximums
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.batch_size = min(4, max_batch_size)
+        self.batch_tokens = min(200, max_batch_tokens)
+        # Keep-alive connections are reused across requests, up to one per concurrent request
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
         ### Taken from https://github.com/nltk/nltk/blob/develop/nltk/sem/boxer.py
         self._boxer_drs_interpreter = NltkDrtBoxerDrsInterpreter()
 
     def interpret(self, sentences, debug=False):
         payload = u'\n'.join(sentences)
-        options = {"instantiate": "true", "format": "prolog"}
-        boxer_out = self._send_request(payload, options=options)
+        boxer_out = self._get_response(payload, INTERPRET_OPTIONS)
         if debug: print "Server Error Message: |{}|".format(boxer_out["err"].replace('\n', '-newline-'))
+        return self._interpret_output(boxer_out)
+
+    def _interpret_output(self, boxer_out):
         try:
             drs_dict = self._parse_to_drs_dict(boxer_out["out"], False)
-        except nltk.sem.logic.LogicalExpressionException:
-            raise CCBoxerAPIException("Unable to parse response.")
-        if len(drs_dict) == 0:
+            # drs_dict has form {'1': DRS1, '2': DRS2, ... }
+            drss = [(int(k), v) for (k, v) in drs_dict.items()]
+        except PARSE_ERRORS, error:
+            # Raised as CCBoxerAPIException, so that only this sentence (or batch) fails in interpret_many
+            raise CCBoxerAPIException("Unable to parse response: {0!r}".format(error))
+        if len(drss) == 0:
             raise CCBoxerAPIException("Recieved empty response.")
-        # drs_dict has form {'1': DRS1, '2': DRS2, ... }
-        drss = [(int(k), v) for (k, v) in drs_dict.items()]
         drss.sort(key=lambda pair: pair[0])
         drss = [pair[1] for pair in drss]
         return drss
 
-    def _send_request(self, payload, options=dict()):
+    def close(self):
+        self._session.close()
+
+    def _try_interpret(self, sentence):
+        try:
+            return self.interpret([sentence])
+        except CCBoxerAPIException, error:
+            return error
+
+    def _map(self, func, items, concurrency):
+        # func applied to each item, with up to concurrency calls at once, in input order
+        if concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        pool = ThreadPool(min(concurrency, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def interpret_many(self, sentences, concurrency=None):
+        """
+        Interprets each sentence on its own, with up to concurrency requests in flight. Returns, in input
+        order, the DRSs of each sentence (as interpret would), or the CCBoxerAPIException if it failed.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+        return self._map(self._try_interpret, sentences, concurrency)
+
+    def _next_batch(self, sentences, start):
+        # At least one sentence, then as many as fit in the batch size and token budget
+        end = start + 1
+        tokens = len(sentences[start].split())
+        while end < len(sentences) and end - start < self.batch_size:
+            tokens += len(sentences[end].split())
+            if tokens > self.batch_tokens:
+                break
+            end += 1
+        return sentences[start:end]
+
+    def _try_interpret_cached(self, sentence):
+        # Result of the sentence (as interpret_many would give it) from the cache, or None if it is not cached
+        if self._cache is None:
+            return None
+        cached = self._cache.get(cache_key(self.server_tag, INTERPRET_OPTIONS, sentence))
+        if cached is None:
+            return None
+        try:
+            return self._interpret_output(self._from_cached(cached))
+        except CCBoxerAPIException, error:
+            return error
+
+    def _interpret_batch(self, batch):
+        # Returns the results of the sentences (as interpret_many would), and whether the batch had to be split
+        if len(batch) == 1:
+            return [self._try_interpret(batch[0])], False
+        try:
+            # Batches differ from run to run, so their responses are cached per sentence instead
+            boxer_out = self._get_response(u'\n'.join(batch), INTERPRET_OPTIONS, cache=False)
+            records = sorted((int(discourse_id), record) for discourse_id, record in iterate_records(boxer_out["out"]))
+        except (CCBoxerAPIException,) + PARSE_ERRORS:
+            records = []
+        # One record per sentence, otherwise they cannot be told apart
+        if len(records) == len(batch):
+            results = []
+            for sentence, (_, record) in zip(batch, records):
+                response = {"out": record + "\n", "err": ""}
+                if self._cache is not None:
+                    self._cache.put(cache_key(self.server_tag, INTERPRET_OPTIONS, sentence), response)
+                try:
+                    results.append(self._interpret_output(response))
+                except CCBoxerAPIException, error:
+                    results.append(error)
+            return results, False
+        # Bisect, so a failing sentence is isolated in O(log n) requests
+        middle = len(batch) // 2
+        left_results, _ = self._interpret_batch(batch[:middle])
+        right_results, _ = self._interpret_batch(batch[middle:])
+        return left_results + right_results, True
+
+    def _adapt_batching(self, split):
+        if split:
+            self.batch_size = max(1, self.batch_size // 2)
+            self.batch_tokens = max(1, self.batch_tokens // 2)
+        else:
+            self.batch_size = min(self.max_batch_size, self.batch_size + 1)
+            self.batch_tokens = min(self.max_batch_tokens, self.batch_tokens + 50)
+
+    def interpret_batched(self, sentences, concurrency=None):
+        """
+        Same as interpret_many, but packs consecutive sentences into batches of one request each, up to the
+        learned batch size and token budget. A failing batch is bisected to find the failing sentences,
+        and the batch size and token budget are halved; they grow again with each batch that succeeds.
+        Sentences are cached one by one, so only the sentences not in the cache are batched.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+        results = [None]*len(sentences)
+        # Indices of the sentences not in the cache
+        missing = []
+        for i, sentence in enumerate(sentences):
+            results[i] = self._try_interpret_cached(sentence)
+            if results[i] is None:
+                if self.offline:
+                    results[i] = self._try_interpret(sentence)
+                else:
+                    missing.append(i)
+        for i, result in zip(missing, self._interpret_batched([sentences[i] for i in missing], concurrency)):
+            results[i] = result
+        return results
+
+    def _interpret_batched(self, sentences, concurrency):
+        results = []
+        start = 0
+        while start < len(sentences):
+            # The batches of one round are sent concurrently, and batching adapts between rounds
+            batches = []
+            while start < len(sentences) and len(batches) < max(1, concurrency):
+                batch = self._next_batch(sentences, start)
+                batches.append(batch)
+                start += len(batch)
+            for batch_results, split in self._map(self._interpret_batch, batches, concurrency):
+                results.extend(batch_results)
+                self._adapt_batching(split)
+        return results
+
+    def _from_cached(self, cached):
+        if "error" in cached:
+            raise CCBoxerAPIException(cached["error"])
+        return cached
+
+    def _get_response(self, payload, options, cache=True):
+        key = None
+        if self._cache is not None and cache:
+            key = cache_key(self.server_tag, options, payload)
+            cached = self._cache.get(key)
+            if cached is not None:
+                return self._from_cached(cached)
+        if self.offline:
+            raise CCBoxerCacheMissException("Response not in cache (offline).")
+        try:
+            response = self._call(payload, options)
+        except CCBoxerServerException, error:
+            if key is not None and error.status_code not in TRANSIENT_STATUS_CODES:
+                self._cache.put(key, {"error": str(error)})
+            raise
+        if key is not None:
+            self._cache.put(key, response)
+        return response
+
+    def _call(self, payload, options):
+        # Sends the request according to the policy, raising CCBoxerUnavailableException if transient errors persist
+        policy = self.policy
+        if not self._breaker.allow():
+            raise CCBoxerUnavailableException("C&C/Boxer server is failing, not calling it for now.")
+        deadline = time.time() + policy.deadline if policy.deadline is not None else None
+        attempt = 0
+        last_error = "deadline exceeded"
+        while True:
+            timeout = policy.timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            try:
+                response = self._send_hedged(payload, options, timeout)
+            except CCBoxerServerException, error:
+                if error.status_code not in TRANSIENT_STATUS_CODES:
+                    # The server is up, it failed on this input
+                    self._breaker.record_success()
+                    raise
+                last_error = error
+            except (requests.Timeout, requests.ConnectionError), error:
+                last_error = error
+            else:
+                self._breaker.record_success()
+                return response
+            attempt += 1
+            if attempt > policy.retries:
+                break
+            # Full jitter, so that concurrent calls do not retry in lockstep
+            delay = random.uniform(0, min(policy.max_backoff, policy.backoff*2**(attempt - 1)))
+            if deadline is not None and time.time() + delay >= deadline:
+                break
+            time.sleep(delay)
+        self._breaker.record_failure()
+        raise CCBoxerUnavailableException("C&C/Boxer server unavailable: {0}".format(last_error))
+
+    def _send_hedged(self, payload, options, timeout):
+        hedge_after = self.policy.hedge_after
+        if hedge_after is None or (timeout is not None and timeout <= hedge_after):
+            return self._send_request(payload, options=options, timeout=timeout)
+        results = Queue.Queue()
+        def attempt():
+            try:
+                results.put((True, self._send_request(payload, options=options, timeout=timeout)))
+            except Exception, error:
+                results.put((False, error))
+        threads = []
+        for hedge in xrange(2):
+            thread = threading.Thread(target=attempt)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+            try:
+                succeeded, result = results.get(timeout=hedge_after if hedge == 0 else None)
+                break
+            except Queue.Empty:
+                # No answer yet, send a duplicate request
+                continue
+        errors = []
+        while True:
+            if succeeded:
+                return result
+            errors.append(result)
+            if len(errors) == len(threads):
+                raise errors[0]
+            succeeded, result = results.get()
+
+    def _send_request(self, payload, options=dict(), timeout=None):
         params = ""
         if len(options) > 0:
             params = '?' + '&'.join([key + '=' + value for (key, value) in options.iteritems()])
         url = self._base_url + params
-        response = requests.post(url, data=payload.encode("UTF-8"), headers={'Content-type': 'text/plain; charset=UTF-8'})
+        response = self._session.post(url, data=payload.encode("UTF-8"), headers={'Content-type': 'text/plain; charset=UTF-8'}, timeout=timeout)
         try:
             response.raise_for_status()
         except requests.HTTPError, error:
-            raise CCBoxerAPIException(str(error))
+            raise CCBoxerServerException(str(error), response.status_code)
         return response.json()
 
-    ### Taken from https://github.com/nltk/nltk/blob/develop/nltk/sem/boxer.py
     def _parse_to_drs_dict(self, boxer_out, use_disc_id):
-        lines = boxer_out.split('\n')
-        drs_dict = {}
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            if line.startswith('id('):
-                comma_idx = line.index(',')
-                discourse_id = line[3:comma_idx]
-                if discourse_id[0] == "'" and discourse_id[-1] == "'":
-                    discourse_id = discourse_id[1:-1]
-                drs_id = line[comma_idx+1:line.index(')')]
-                i += 1
-                line = lines[i]
-                assert line.startswith('sem({0},'.format(drs_id))
-                if line[-4:] == "').'":
-                    line = line[:-4] + ")."
-                assert line.endswith(').'), "can't parse line: {0}".format(line)
-
-                search_start = len('sem({0},['.format(drs_id))
-                brace_count = 1
-                drs_start = -1
-                for j,c in enumerate(line[search_start:]):
-                    if(c == '['):
-                        brace_count += 1
-                    if(c == ']'):
-                        brace_count -= 1
-                        if(brace_count == 0):
-                            drs_start = search_start + j + 1
-                            if line[drs_start:drs_start+3] == "','":
-                                drs_start = drs_start + 3
-                            else:
-                                drs_start = drs_start + 1
-                            break
-                assert drs_start > -1
-
-                drs_input = line[drs_start:-2].strip()
-                parsed = self._parse_drs(drs_input, discourse_id, use_disc_id)
-                drs_dict[discourse_id] = self._boxer_drs_interpreter.interpret(parsed)
-            i += 1
-        return drs_dict
+        return dict(self._iterate_drss(boxer_out, use_disc_id))
+
+    def _iterate_drss(self, boxer_out, use_disc_id):
+        # Yields (discourse id, DRS) for each record in the output, as it is parsed
+        for discourse_id, drs_input in iterate_drs_records(boxer_out):
+            parsed = self._parse_drs(drs_input, discourse_id, use_disc_id)
+            yield discourse_id, self._boxer_drs_interpreter.interpret(parsed)
 
     ### Taken from https://github.com/nltk/nltk/blob/develop/nltk/sem/boxer.py
     def _parse_drs(self, drs_string, discourse_id, use_disc_id):
@@ -0,0 +1,177 @@
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import random
+import re
+import socket
+import sys
+import time
+from urlparse import urlparse
+
+
+PIPELINE_PATH = "/json/pipeline"
+RECORD_ID_REGEX = re.compile(r"^(id\()([^,\n]*),([^)\n]*)(\)\.)$|^(sem\()([^,\n]*)(,)", re.MULTILINE)
+
+
+def make_prolog_output(sentence, discourse_id):
+    # Output of the form C&C/Boxer returns for one sentence, with a predicate for each word
+    words = re.findall(r"\w+", sentence.lower(), re.UNICODE) or ["empty"]
+    tokens = []
+    conditions = []
+    for j, word in enumerate(words, 1):
+        token_id = 1000*discourse_id + j
+        word = re.sub(r"[^a-z0-9]", "", word.encode("ascii", "ignore")) or "x"
+        tokens.append("{0}:[tok:'{1}',pos:'NN',lemma:{1},namex:'O']".format(token_id, word))
+        conditions.append("[{0}]:pred(x1,{1},n,0)".format(token_id, word))
+    return "id({0},{0}).\nsem({0},[{1}],drs([[]:x1],[{2}])).".format(discourse_id, ",".join(tokens), ",".join(conditions))
+
+def renumber_prolog_output(output, discourse_id):
+    # A recorded output of a sentence on its own, as the output of the sentence at the given position
+    def replace(m):
+        if m.group(1) is not None:
+            return "{0}{1},{1}{2}".format(m.group(1), discourse_id, m.group(4))
+        return "{0}{1}{2}".format(m.group(5), discourse_id, m.group(7))
+    return RECORD_ID_REGEX.sub(replace, output)
+
+def crashes(sentence, crash_rate, crash_words=None):
+    # Whether C&C/Boxer "crashes" on the sentence, the same way every time
+    if crash_words is not None and len(re.findall(r"\w+", sentence, re.UNICODE)) > crash_words:
+        return True
+    digest = hashlib.sha1(sentence.encode("UTF-8")).hexdigest()
+    return int(digest[:8], 16) < crash_rate*0x100000000
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Local stand-in for the C&C/Boxer server, speaking the same /json/pipeline protocol. Sentences are answered
+    with their recorded outputs (sentence => Prolog output of the sentence on its own), or generated ones.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, recordings=None, latency=0.05, latency_per_sentence=0.01, error_rate=0.0, crash_rate=0.0, crash_words=None, seed=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandInRequestHandler)
+        self.recordings = recordings if recordings is not None else dict()
+        # Seconds per request and per sentence, as the mean of an exponential distribution
+        self.latency = latency
+        self.latency_per_sentence = latency_per_sentence
+        # Fraction of requests failing with 503, as if the server were overloaded
+        self.error_rate = error_rate
+        # Fraction of sentences the server fails on (with 500), in any request
+        self.crash_rate = crash_rate
+        # Sentences with more words always fail, as long sentences do with C&C/Boxer
+        self.crash_words = crash_words
+        self.random = random.Random(seed)
+
+    def handle_error(self, request, client_address):
+        # Module globals are None once the interpreter shuts down, with request threads still running
+        if sys is None:
+            return
+        # Clients that gave up on a request (e.g. after a timeout) are expected
+        if isinstance(sys.exc_info()[1], socket.error):
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def respond(self, payload):
+        # Returns (status code, response)
+        sentences = payload.split(u"\n")
+        delay = self.latency + self.latency_per_sentence*len(sentences)
+        if delay > 0:
+            time.sleep(self.random.expovariate(1.0/delay))
+        if self.random.random() < self.error_rate:
+            return 503, None
+        if any(crashes(sentence, self.crash_rate, self.crash_words) for sentence in sentences):
+            return 500, None
+        outputs = []
+        for i, sentence in enumerate(sentences, 1):
+            if sentence in self.recordings:
+                outputs.append(renumber_prolog_output(self.recordings[sentence], i))
+            else:
+                outputs.append(make_prolog_output(sentence, i))
+        return 200, {"out": "\n".join(outputs) + "\n", "err": ""}
+
+
+class StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written at once, when the request is handled
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # Otherwise small responses on keep-alive connections wait for the client's delayed ACK (~40ms)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        if urlparse(self.path).path != PIPELINE_PATH:
+            self._send(404, None)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = self.rfile.read(length).decode("UTF-8")
+        status_code, response = self.server.respond(payload)
+        self._send(status_code, response)
+
+    def _send(self, status_code, response):
+        body = json.dumps(response) if response is not None else ""
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_recordings(recordings_filepath):
+    if recordings_filepath is None:
+        return dict()
+    with open(recordings_filepath, 'r') as f:
+        return json.load(f)
+
+
+def main(args):
+    server = StandInServer((args.host, args.port),
+                           recordings=load_recordings(args.recordings_filepath),
+                           latency=args.latency,
+                           latency_per_sentence=args.latency_per_sentence,
+                           error_rate=args.error_rate,
+                           crash_rate=args.crash_rate,
+                           crash_words=args.crash_words,
+                           seed=args.seed)
+    print("Serving C&C/Boxer stand-in on http://{0}:{1}{2}".format(args.host, args.port, PIPELINE_PATH))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the C&C/Boxer server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--recordings-filepath",
+                        type=str,
+                        default=None,
+                        help="JSON file of recorded outputs, sentence => Prolog output (see boxer_load_test.py --record).")
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.05,
+                        help="Mean seconds per request.")
+    parser.add_argument("--latency-per-sentence",
+                        type=float,
+                        default=0.01,
+                        help="Mean seconds added per sentence in a request.")
+    parser.add_argument("--error-rate",
+                        type=float,
+                        default=0.0,
+                        help="Fraction of requests that fail with 503.")
+    parser.add_argument("--crash-rate",
+                        type=float,
+                        default=0.0,
+                        help="Fraction of sentences that C&C/Boxer fails on (with 500), whenever they are sent.")
+    parser.add_argument("--crash-words",
+                        type=int,
+                        default=None,
+                        help="Sentences with more words always fail (with 500).")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,128 @@
+# This Python file uses the following encoding: UTF-8
+import re
+from nltk.tokenize import word_tokenize
+import irc_crawler
+
+
+# Sentences with more tokens than this are split before semantic parsing; C&C/Boxer crashes mostly on longer ones
+MAX_TOKENS = 40
+SEMICOLON_REGEX = re.compile(ur";\s+", re.UNICODE)
+# Separator before an inline enumeration item, e.g. "the following: (A) ..., (B) ..., and (C) ..."
+ENUMERATION_REGEX = re.compile(ur"(?:[:—]|,(?:\s+(?:and|or))?)\s+(?=\((?:[0-9]+|[a-zA-Z]{1,4})\)\s)", re.UNICODE)
+
+
+def count_tokens(text):
+    return len(word_tokenize(text))
+
+def _find_cuts(text, regex):
+    return [m.end() for m in regex.finditer(text)]
+
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def _pack(pieces, max_tokens):
+    # Merges adjacent (start, end, token count) pieces while they fit in max_tokens
+    packed = []
+    for start, end, count in pieces:
+        if len(packed) > 0 and packed[-1][2] + count <= max_tokens:
+            packed[-1] = (packed[-1][0], end, packed[-1][2] + count)
+        else:
+            packed.append((start, end, count))
+    return packed
+
+def _split(text, start, end, boundaries, max_tokens):
+    # (start, end, token count) of the chunks of text[start:end], splitting at the first kind of boundary found in it
+    start, end = _strip_span(text, start, end)
+    if start == end:
+        return []
+    count = count_tokens(text[start:end])
+    if count <= max_tokens:
+        return [(start, end, count)]
+    for k, cuts in enumerate(boundaries):
+        cuts = [cut for cut in cuts if start < cut < end]
+        if len(cuts) == 0:
+            continue
+        pieces = []
+        bounds = [start] + cuts + [end]
+        for piece_start, piece_end in zip(bounds, bounds[1:]):
+            pieces.extend(_split(text, piece_start, piece_end, boundaries[k+1:], max_tokens))
+        return _pack(pieces, max_tokens)
+    # No boundary left, the chunk stays too long
+    return [(start, end, count)]
+
+def split_sentence(sentence, max_tokens=MAX_TOKENS, fragment_offsets=()):
+    """
+    Splits a sentence with more than max_tokens tokens at structural boundaries: the offsets of its
+    sentence fragments (chapeau, sublevels, continuation) if given, then semicolons, then inline
+    enumerations. Adjacent pieces are packed back together up to max_tokens tokens.
+    """
+    boundaries = [sorted(fragment_offsets), _find_cuts(sentence, SEMICOLON_REGEX), _find_cuts(sentence, ENUMERATION_REGEX)]
+    return [sentence[start:end] for start, end, _ in _split(sentence, 0, len(sentence), boundaries, max_tokens)]
+
+def split_sentences(sentences, max_tokens=MAX_TOKENS):
+    # Chunks of the sentences, as a list of (index of the sentence, chunk)
+    chunks = []
+    for i, sentence in enumerate(sentences):
+        chunks.extend((i, chunk) for chunk in split_sentence(sentence, max_tokens))
+    return chunks
+
+def split_level(level, max_tokens=MAX_TOKENS):
+    """
+    Splits the sentences of a level for semantic parsing, also at the boundaries of its sentence fragments.
+    Returns the sentences and the chunks, as a list of (index of the sentence, chunk).
+    """
+    fragments = level.get_sentence_fragments()
+    sentences = level.get_sentences()
+    # Sentences are spans of the space-joined fragments
+    text = u" ".join(fragments)
+    fragment_offsets = []
+    offset = 0
+    for fragment in fragments[:-1]:
+        offset += len(fragment) + 1
+        fragment_offsets.append(offset)
+    chunks = []
+    position = 0
+    for i, sentence in enumerate(sentences):
+        start = text.find(sentence, position)
+        offsets = []
+        if start >= 0:
+            position = start + len(sentence)
+            offsets = [o - start for o in fragment_offsets if start < o < position]
+        chunks.extend((i, chunk) for chunk in split_sentence(sentence, max_tokens, offsets))
+    return sentences, chunks
+
+
+def main(args):
+    crawler = irc_crawler.IRCCrawler()
+    try:
+        level = crawler.get_level(args.level_id)
+    except irc_crawler.LevelDoesNotExistException:
+        raise Exception("Invalid level-id arg: {0}".format(args.level_id))
+    sentences, chunks = split_level(level, args.max_tokens)
+    for i, sentence in enumerate(sentences):
+        sentence_chunks = [chunk for j, chunk in chunks if j == i]
+        print(u"[{0}] ({1} tokens, {2} chunks) {3}".format(i, count_tokens(sentence), len(sentence_chunks), sentence).encode("UTF-8"))
+        if len(sentence_chunks) > 1:
+            for chunk in sentence_chunks:
+                print(u"    ({0} tokens) {1}".format(count_tokens(chunk), chunk).encode("UTF-8"))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Split the sentences of a level of the Internal Revenue Code into chunks for semantic parsing.")
+    parser.add_argument("--level-id",
+                        type=str,
+                        default="s163/h",
+                        help="Specifies the level (section, subsection, paragraph, etc.) to split. " + \
+                              "Should have pattern s[section]/[subsection]/[paragraph]/[subparagraph]/[clause]/[subclause]/[item]/[subitem]/[subsubitem]. " + \
+                              "For example, 's163/h/1' specifies section 163, subsection h, paragraph 1.")
+    parser.add_argument("--max-tokens",
+                        type=int,
+                        default=MAX_TOKENS,
+                        help="Sentences with more tokens are split.")
+    args = parser.parse_args()
+    main(args)
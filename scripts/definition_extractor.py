@@ -1,7 +1,9 @@
 # This Python file uses the following encoding: UTF-8
 import re
+import irc_cache
 from irc_crawler import IRCCrawler
 from collections import OrderedDict
+from term_automaton import TermAutomaton
 
 
 DEFINITION_TYPES = [
@@ -13,6 +15,12 @@ DEFINITION_TYPES = [
     u"shall not include"
 ]
 TERM_REGEX = re.compile(ur"the term (?:(“[^”]+”)|(‘[^’]+’)) (?:{0})".format(u"|".join(DEFINITION_TYPES)), re.UNICODE | re.IGNORECASE)
+# Finds every term definition in one scan, as a lookahead so that overlapping candidates are not skipped
+TERM_DEFINITION_REGEX = re.compile(ur"(?=the term (?:“([^”]+)”|‘([^’]+)’) ({0})(.*))".format(u"|".join(DEFINITION_TYPES)), re.UNICODE | re.IGNORECASE)
+# Terms with these characters are matched with get_term_regex, since the term is used as a regex there
+SPECIAL_TERM_CHARS = set(u".^$*+?{}[]\\|()“”‘’")
+# Terms defined in each section, by hash of this module
+GLOBAL_TERMS_RESULTS_FILENAME = "defined_terms_results-{0}.pkl"
 
 
 def get_term_regex(term):
@@ -37,16 +45,41 @@ def extract_defined_terms(level):
         defined_terms.append(term)
     return defined_terms
 
+def find_term_definitions(sentence, terms_by_lowercase, special_term_regexs):
+    # Term => list of (definition type, rest), same as get_term_regex(term).findall(sentence) for every term
+    matches = dict()
+    line_ends = dict()
+    for m in TERM_DEFINITION_REGEX.finditer(sentence):
+        quoted_term = m.group(1) if m.group(1) is not None else m.group(2)
+        for term in terms_by_lowercase.get(quoted_term.lower(), []):
+            # The rest of a definition runs to the end of the line, hiding later ones on the same line
+            if term in line_ends and m.start() < line_ends[term]:
+                continue
+            line_ends[term] = m.end(4)
+            matches.setdefault(term, []).append((m.group(3), m.group(4)))
+    for term, term_def_regex in special_term_regexs.items():
+        term_matches = term_def_regex.findall(sentence)
+        if len(term_matches) > 0:
+            matches[term] = term_matches
+    return matches
+
 def extract_definitions(level):
     defined_terms = extract_defined_terms(level)
     unique_terms = set(defined_terms)
+    term_order = dict((term, i) for i, term in enumerate(unique_terms))
+    terms_by_lowercase = dict()
+    special_term_regexs = dict()
+    for term in unique_terms:
+        if any(c in SPECIAL_TERM_CHARS for c in term):
+            special_term_regexs[term] = get_term_regex(term)
+        else:
+            terms_by_lowercase.setdefault(term.lower(), []).append(term)
     definitions = OrderedDict()
     sentences = level.get_sentences()
     for sentence in sentences:
-        for term in unique_terms:
-            term_def_regex = get_term_regex(term)
-            matches = term_def_regex.findall(sentence)
-            if len(matches) == 0: continue
+        sentence_matches = find_term_definitions(sentence, terms_by_lowercase, special_term_regexs)
+        for term in sorted(sentence_matches, key=lambda t: term_order[t]):
+            matches = sentence_matches[term]
             assert len(matches) == 1
             def_type, rest = matches[0]
             assert def_type in DEFINITION_TYPES
@@ -62,35 +95,76 @@ def extract_definitions(level):
             }
     return defined_terms, definitions
 
-def fol_definitions(level):
+def load_global_terms(crawler=None):
+    # Every term defined anywhere in the IRC, in document order
+    if crawler is None:
+        crawler = IRCCrawler(streaming=True, compact=True)
+    global_terms = []
+    seen = set()
+    for section_terms in crawler.map_sections(extract_defined_terms, results_filename=GLOBAL_TERMS_RESULTS_FILENAME.format(irc_cache.code_hash(__file__))):
+        for term in section_terms:
+            if term not in seen:
+                seen.add(term)
+                global_terms.append(term)
+    return global_terms
+
+def _find_term_references(definitions, other_terms, whole_words=False):
+    # Yields (term, definition, other term) for every other term mentioned in the rest of a definition, in the order
+    # of other_terms (which may have duplicates). With whole_words, "tax" is not found in "taxpayer"
+    automaton = TermAutomaton(set(other_terms))
+    term_positions = dict()
+    for i, other_term in enumerate(other_terms):
+        term_positions.setdefault(other_term, []).append(i)
+    for term, definition in definitions.items():
+        mentioned_terms = automaton.find_terms(definition["rest"], whole_words=whole_words)
+        positions = sorted(i for other_term in mentioned_terms for i in term_positions[other_term])
+        for i in positions:
+            if other_terms[i] == term: continue
+            yield term, definition, other_terms[i]
+
+def get_other_terms(defined_terms, global_terms=None):
+    if global_terms is None:
+        return defined_terms
+    seen = set(defined_terms)
+    return defined_terms + [t for t in global_terms if t not in seen]
+
+def term_dependencies(level, global_terms=None, whole_words=False):
+    # Edge list of (defined term, term mentioned in its definition), optionally including terms defined elsewhere in the IRC
+    defined_terms, definitions = extract_definitions(level)
+    edges = []
+    seen = set()
+    for term, _, other_term in _find_term_references(definitions, get_other_terms(defined_terms, global_terms), whole_words=whole_words):
+        if (term, other_term) not in seen:
+            seen.add((term, other_term))
+            edges.append((term, other_term))
+    return edges
+
+def fol_definitions(level, global_terms=None, whole_words=False):
     definition_fol_template = u"all x.({0}{1}(x) -> {2}{3}(x))"
     definitions_as_fol = []
     defined_terms, definitions = extract_definitions(level)
-    for term, definition in definitions.items():
+    for term, definition, other_term in _find_term_references(definitions, get_other_terms(defined_terms, global_terms), whole_words=whole_words):
         def_type = definition["type"]
         rest = definition["rest"]
-        for other_term in defined_terms:
-            if other_term == term: continue
-            if other_term in rest:
-                other_term_sign = ""
-                if "not" in def_type:
-                    other_term_sign = "-"
-                other_term_predicate = term_to_predicate(other_term)
-                defined_term_sign = ""
-                if "other than" in rest or "except" in rest:
-                    defined_term_sign = "-"
-                defined_term_predicate = term_to_predicate(term)
-                definition_fol = definition_fol_template.format(
-                    other_term_sign,
-                    other_term_predicate,
-                    defined_term_sign,
-                    defined_term_predicate
-                )
-                definitions_as_fol.append({
-                    "term": term,
-                    "definition": definition,
-                    "fol": definition_fol
-                })
+        other_term_sign = ""
+        if "not" in def_type:
+            other_term_sign = "-"
+        other_term_predicate = term_to_predicate(other_term)
+        defined_term_sign = ""
+        if "other than" in rest or "except" in rest:
+            defined_term_sign = "-"
+        defined_term_predicate = term_to_predicate(term)
+        definition_fol = definition_fol_template.format(
+            other_term_sign,
+            other_term_predicate,
+            defined_term_sign,
+            defined_term_predicate
+        )
+        definitions_as_fol.append({
+            "term": term,
+            "definition": definition,
+            "fol": definition_fol
+        })
     return definitions_as_fol
 
 def term_to_predicate(term):
@@ -105,7 +179,13 @@ def main(args):
     crawler = IRCCrawler()
     level = crawler.get_level(args.level_id)
 
-    definitions_as_fol = fol_definitions(level)
+    global_terms = load_global_terms() if args.global_terms else None
+    if args.dependencies:
+        for term, other_term in term_dependencies(level, global_terms=global_terms, whole_words=args.whole_words):
+            print(u"{} -> {}".format(term, other_term))
+        return
+
+    definitions_as_fol = fol_definitions(level, global_terms=global_terms, whole_words=args.whole_words)
     if len(definitions_as_fol) == 0:
         print("Info: No term definitions found.")
         return
@@ -126,5 +206,14 @@ if __name__ == "__main__":
                         help="Specifies the level (section, subsection, paragraph, etc.) to find. " + \
                               "Should have pattern s[section]/[subsection]/[paragraph]/[subparagraph]/[clause]/[subclause]/[item]. " + \
                               "For example, 's163/h/1' specifies section 163, subsection h, paragraph 1.")
+    parser.add_argument("--global-terms",
+                        action="store_true",
+                        help="Also look for references to terms defined anywhere in the IRC, not just in the level.")
+    parser.add_argument("--dependencies",
+                        action="store_true",
+                        help="Print the term dependency edges (defined term -> term mentioned in its definition) instead of FOL.")
+    parser.add_argument("--whole-words",
+                        action="store_true",
+                        help="Only find references to terms as whole words (e.g. \"tax\" is not found in \"taxpayer\").")
     args = parser.parse_args()
     main(args)
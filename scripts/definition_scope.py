@@ -0,0 +1,183 @@
+# This Python file uses the following encoding: UTF-8
+import re
+from array import array
+from bisect import bisect_right
+import irc_cache
+import irc_crawler
+from definition_extractor import TERM_DEFINITION_REGEX
+from level_index import get_own_text_fragments
+from pattern_counts import LEAD_INS
+
+
+# "For purposes of this subsection", "In this part", etc., with the kind of level the lead-in refers to
+LEAD_IN_REGEX = re.compile(ur"\b(?:{0}) (\w+)".format(u"|".join(LEAD_INS)), re.UNICODE | re.IGNORECASE)
+
+
+def find_lead_ins(text):
+    # (position, tag) of each lead-in referring to a kind of level
+    lead_ins = []
+    for m in LEAD_IN_REGEX.finditer(text):
+        tag = m.group(1).lower()
+        if tag in irc_crawler.TAGS or tag in irc_crawler.CONTAINER_TAGS:
+            lead_ins.append((m.start(), tag))
+    return lead_ins
+
+
+class DefinitionScopeIndex(object):
+    """
+    Scopes of all term definitions in the IRC, as ranges of levels in document order. A definition applies
+    to the level its lead-in refers to ("For purposes of this subsection", "In this part"), either in the
+    sentence of the definition or in the chapeau of an enclosing level, and otherwise to its section.
+    Scopes are subtrees or runs of whole sections within a container, so any two are either nested or
+    disjoint; each is stored with the smallest scope enclosing it, and the scopes containing a level are
+    found by a binary search followed by a walk up the enclosing scopes.
+    """
+    def __init__(self, level_ids, starts, ends, parents, scope_ids, definitions):
+        # Level ids in document order
+        self.level_ids = level_ids
+        self._positions = dict((level_id, i) for i, level_id in reversed(list(enumerate(level_ids))))
+        # Scopes sorted by start (outermost first for equal starts), with the enclosing scope (or -1)
+        self.starts = starts
+        self.ends = ends
+        self.parents = parents
+        # Level id (or container identifier) each scope refers to
+        self.scope_ids = scope_ids
+        # Scope => [(term, level id of the definition)]
+        self.definitions = definitions
+
+    @staticmethod
+    def build(crawler=None):
+        if crawler is None:
+            crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+        tree = crawler.load_level_tree()
+        section_containers = crawler.get_section_containers()
+        # Container identifier => [start, end]
+        container_ranges = dict()
+        for root in tree.roots:
+            for identifier in section_containers.get(tree.ids[root], dict()).values():
+                container_range = container_ranges.setdefault(identifier, [root, tree.end[root]])
+                container_range[0] = min(container_range[0], root)
+                container_range[1] = max(container_range[1], tree.end[root])
+        # Tag of the lead-in in the chapeau of each level, or of its nearest ancestor with one
+        inherited_tags = [None]*len(tree)
+        # (start, end, scope id) => [(term, level id)]
+        scopes = dict()
+        for i in xrange(len(tree)):
+            parent = tree.parent[i]
+            inherited_tag = inherited_tags[parent] if parent >= 0 else None
+            if tree.chapeau[i] is not None:
+                lead_ins = find_lead_ins(tree.chapeau[i])
+                if len(lead_ins) > 0:
+                    inherited_tag = lead_ins[-1][1]
+            inherited_tags[i] = inherited_tag
+            text = u" ".join(get_own_text_fragments(tree.get_level(i)))
+            lead_ins = find_lead_ins(text)
+            for m in TERM_DEFINITION_REGEX.finditer(text):
+                term = m.group(1) if m.group(1) is not None else m.group(2)
+                tag = inherited_tag
+                preceding = [t for position, t in lead_ins if position < m.start()]
+                if len(preceding) > 0:
+                    tag = preceding[-1]
+                scope = _resolve_scope(tree, section_containers, container_ranges, i, tag)
+                scopes.setdefault(scope, []).append((term, tree.ids[i]))
+        ordered_scopes = sorted(scopes, key=lambda scope: (scope[0], -scope[1]))
+        starts, ends, parents = array('i'), array('i'), array('i')
+        # Scopes enclosing the current one, innermost last
+        enclosing = []
+        for start, end, _ in ordered_scopes:
+            while len(enclosing) > 0 and ends[enclosing[-1]] <= start:
+                enclosing.pop()
+            parents.append(enclosing[-1] if len(enclosing) > 0 else -1)
+            enclosing.append(len(starts))
+            starts.append(start)
+            ends.append(end)
+        scope_ids = [scope[2] for scope in ordered_scopes]
+        definitions = [scopes[scope] for scope in ordered_scopes]
+        return list(tree.ids), starts, ends, parents, scope_ids, definitions
+
+    def get_scopes(self, level_id):
+        # Scopes containing the level, innermost first
+        level_id = unicode(level_id)
+        if level_id not in self._positions:
+            raise irc_crawler.LevelDoesNotExistException()
+        position = self._positions[level_id]
+        scopes = []
+        scope = bisect_right(self.starts, position) - 1
+        while scope >= 0:
+            if position < self.ends[scope]:
+                scopes.append(scope)
+            scope = self.parents[scope]
+        return scopes
+
+    def get_definitions(self, level_id):
+        """
+        Returns the definitions that apply at the level, innermost scope first, as a list of
+        (term, level id of the definition, scope id).
+        """
+        definitions = []
+        for scope in self.get_scopes(level_id):
+            definitions += [(term, defining_level_id, self.scope_ids[scope]) for term, defining_level_id in self.definitions[scope]]
+        return definitions
+
+    def get_terms(self, level_id):
+        # Terms that apply at the level, once each
+        terms = []
+        seen = set()
+        for term, _, _ in self.get_definitions(level_id):
+            if term not in seen:
+                seen.add(term)
+                terms.append(term)
+        return terms
+
+
+def _resolve_scope(tree, section_containers, container_ranges, i, tag):
+    # (start, end, scope id) of the level (or container) with the given tag enclosing level i
+    root = tree.get_root(i)
+    if tag in irc_crawler.CONTAINER_TAGS:
+        identifier = section_containers.get(tree.ids[root], dict()).get(tag)
+        if identifier is not None:
+            start, end = container_ranges[identifier]
+            return start, end, identifier
+    elif tag is not None:
+        tag_index = irc_crawler.TAGS.index(tag)
+        j = i
+        while j >= 0:
+            if tree.tag[j] == tag_index:
+                return j, tree.end[j], tree.ids[j]
+            j = tree.parent[j]
+    # Lead-in missing, or the level it refers to was not found
+    return root, tree.end[root], tree.ids[root]
+
+def load_definition_scope_index(crawler=None):
+    if crawler is None:
+        crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+    source_hash = irc_cache.file_hash(crawler.xml_filepath)
+    index_filename = "definition_scopes-{0}.pkl".format(source_hash)
+    scope_index = irc_cache.load_pickle(index_filename)
+    if scope_index is None:
+        scope_index = DefinitionScopeIndex.build(crawler)
+        irc_cache.dump_pickle(index_filename, scope_index)
+    return DefinitionScopeIndex(*scope_index)
+
+
+def main(args):
+    scope_index = load_definition_scope_index()
+    definitions = scope_index.get_definitions(args.level_id)
+    if len(definitions) == 0:
+        print("Info: No definitions apply.")
+        return
+    for term, defining_level_id, scope_id in definitions:
+        print(u"{0} (defined in {1}, for {2})".format(term, defining_level_id, scope_id).encode("UTF-8"))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Find the term definitions that apply at a level of the Internal Revenue Code.")
+    parser.add_argument("--level-id",
+                        type=str,
+                        default="s163/h",
+                        help="Specifies the level (section, subsection, paragraph, etc.) to find. " + \
+                              "Should have pattern s[section]/[subsection]/[paragraph]/[subparagraph]/[clause]/[subclause]/[item]/[subitem]/[subsubitem]. " + \
+                              "For example, 's163/h/1' specifies section 163, subsection h, paragraph 1.")
+    args = parser.parse_args()
+    main(args)
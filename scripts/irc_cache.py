@@ -0,0 +1,125 @@
+import os
+from os.path import dirname, exists, join, realpath, splitext
+import hashlib
+import json
+import cPickle as pickle
+
+
+CACHE_DIR = join(dirname(dirname(realpath(__file__))), "irc/cache")
+# Bump when the format of cached data changes
+CACHE_VERSION = 2
+HASHES_FILENAME = "hashes.json"
+
+
+def cache_filepath(filename):
+    if not exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    return join(CACHE_DIR, filename)
+
+def _write_json(filepath, data):
+    # Write-then-rename, so that concurrent readers never see a partially written file
+    tmp_filepath = "{0}.{1}.tmp".format(filepath, os.getpid())
+    with open(tmp_filepath, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp_filepath, filepath)
+
+def file_hash(filepath, block_size=1 << 20):
+    # Hashing all of irc.xml is slow, so hashes are remembered by file size and modification time
+    filepath = realpath(filepath)
+    hashes_filepath = cache_filepath(HASHES_FILENAME)
+    hashes = dict()
+    if exists(hashes_filepath):
+        with open(hashes_filepath, 'r') as f:
+            hashes = json.load(f)
+    stat = os.stat(filepath)
+    stat_key = [stat.st_size, stat.st_mtime]
+    if filepath in hashes and hashes[filepath][:2] == stat_key:
+        return hashes[filepath][2]
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    hashes[filepath] = stat_key + [sha1.hexdigest()]
+    _write_json(hashes_filepath, hashes)
+    return sha1.hexdigest()
+
+def code_hash(*filepaths):
+    # Hash of the source of the given modules, so results computed with their code are not reused once it changes
+    sha1 = hashlib.sha1()
+    for filepath in filepaths:
+        with open(splitext(filepath)[0] + ".py", 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+def _source_filepath(filename, source_hash):
+    # One file per source, so caches for several versions of irc.xml can coexist
+    base, extension = splitext(filename)
+    return cache_filepath("{0}-{1}{2}".format(base, source_hash, extension))
+
+def load_json(filename, source_hash):
+    filepath = _source_filepath(filename, source_hash)
+    if not exists(filepath):
+        return None
+    with open(filepath, 'r') as f:
+        cached = json.load(f)
+    if cached["source-hash"] != source_hash or cached.get("version") != CACHE_VERSION:
+        return None
+    return cached["data"]
+
+def dump_json(filename, source_hash, data):
+    _write_json(_source_filepath(filename, source_hash), {"source-hash": source_hash, "version": CACHE_VERSION, "data": data})
+
+def load_pickle(filename):
+    filepath = cache_filepath(filename)
+    if not exists(filepath):
+        return None
+    with open(filepath, 'rb') as f:
+        return pickle.load(f)
+
+def dump_pickle(filename, data):
+    filepath = cache_filepath(filename)
+    tmp_filepath = "{0}.{1}.tmp".format(filepath, os.getpid())
+    with open(tmp_filepath, 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_filepath, filepath)
+
+
+class RecordWriter(object):
+    """
+    Appends pickled records to a cache file, keeping track of the offset of each one.
+    The file only replaces any existing one when committed.
+    """
+    def __init__(self, filename):
+        self.filepath = cache_filepath(filename)
+        self._tmp_filepath = "{0}.{1}.tmp".format(self.filepath, os.getpid())
+        self._file = open(self._tmp_filepath, 'wb')
+
+    def write(self, record):
+        offset = self._file.tell()
+        pickle.dump(record, self._file, pickle.HIGHEST_PROTOCOL)
+        return offset
+
+    def write_bytes(self, data):
+        offset = self._file.tell()
+        self._file.write(data)
+        return offset
+
+    def commit(self):
+        self._file.close()
+        os.rename(self._tmp_filepath, self.filepath)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_filepath)
+
+def read_records(filename, offsets=None):
+    with open(cache_filepath(filename), 'rb') as f:
+        if offsets is None:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+        for offset in offsets:
+            f.seek(offset)
+            yield pickle.load(f)
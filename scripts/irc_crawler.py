@@ -1,13 +1,30 @@
 # This Python file uses the following encoding: UTF-8
-from os.path import dirname, join, realpath
+from os.path import dirname, join, realpath, splitext
 from lxml import etree
 from collections import OrderedDict
+from array import array
+from multiprocessing import Pool
+from bisect import bisect_left, bisect_right
+import copy
+import hashlib
+import json
+import mmap
 import re
+import nltk
 from nltk.tokenize import sent_tokenize, word_tokenize
+import irc_cache
 
 
 IRC_XML_FILEPATH = join(dirname(dirname(realpath(__file__))), "irc/xml/irc.xml")
+IDENTIFIER_PREFIX = u"/us/usc/t26/"
+IDENTIFIER_INDEX_FILENAME = "identifier_index.json"
+CORPUS_INDEX_FILENAME = "corpus_index.json"
+SECTION_CONTAINERS_FILENAME = "section_containers.json"
 TAGS = ["section", "subsection", "paragraph", "subparagraph", "clause", "subclause", "item", "subitem", "subsubitem"]
+# Levels above sections
+CONTAINER_TAGS = ["title", "subtitle", "chapter", "subchapter", "part", "subpart"]
+# Start and end tags of sections in the raw XML, to find the bytes of each section without parsing
+SECTION_TAG_REGEX = re.compile(r"<(/?)section(?=[\s/>])")
 
 
 class LevelId:
@@ -49,6 +66,47 @@ class LevelHasNoIdException(Exception):
 class LevelDoesNotExistException(Exception):
     pass
 
+class SentenceSegmentation(object):
+    """
+    Sentence spans over the (space-joined) sentence fragments of a level. The segmentation is shared
+    by all sublevels, whose sentences are the spans clipped to their own fragments, so the text is
+    only tokenized once.
+    """
+    def __init__(self, fragments):
+        self.text = u" ".join(fragments)
+        # Start offset of each fragment, plus one past the end of the text
+        self.fragment_offsets = []
+        offset = 0
+        for fragment in fragments:
+            self.fragment_offsets.append(offset)
+            offset += len(fragment) + 1
+        self.fragment_offsets.append(offset)
+        # Same tokenizer as sent_tokenize
+        tokenizer = nltk.data.load("tokenizers/punkt/english.pickle")
+        spans = tokenizer.span_tokenize(self.text)
+        self.span_starts = [start for start, _ in spans]
+        self.span_ends = [end for _, end in spans]
+
+    def get_sentences(self, fragment_start, fragment_end):
+        if fragment_start == fragment_end:
+            return []
+        start = self.fragment_offsets[fragment_start]
+        end = self.fragment_offsets[fragment_end] - 1
+        # As if tokenizing the text in [start, end) alone: the first sentence starts at its start,
+        # and the last sentence ends at its end, without trailing whitespace
+        while end > start and self.text[end - 1].isspace():
+            end -= 1
+        # Spans overlapping [start, end)
+        i = bisect_right(self.span_ends, start)
+        j = bisect_left(self.span_starts, end)
+        if i >= j:
+            return [self.text[start:end]] if start < end else []
+        bounds = [[max(self.span_starts[k], start), min(self.span_ends[k], end)] for k in xrange(i, j)]
+        bounds[0][0] = start
+        bounds[-1][1] = end
+        return [self.text[s:e] for s, e in bounds if s < e]
+
+
 class Level:
     @staticmethod
     def _validate(id, tag, num, heading, chapeau, content, sublevels, continuation):
@@ -74,6 +132,8 @@ class Level:
         self._sentences = None
         self._avg_tokens_per_sentence = None
         self._total_token_count = None
+        self._segmentation = None
+        self._fragment_start = None
 
     def get_total_token_count(self, word_tokenizer=word_tokenize):
         if self._total_token_count is None:
@@ -99,10 +159,28 @@ class Level:
     def get_sentences(self, sentence_tokenizer=sent_tokenize):
         if self._sentences is None:
             sent_fragments = self.get_sentence_fragments()
-            level_str = u" ".join(sent_fragments)
-            self._sentences = sentence_tokenizer(level_str)
+            if sentence_tokenizer is sent_tokenize:
+                # Reuse the segmentation of an ancestor, if any
+                if self._segmentation is None:
+                    self._share_segmentation(SentenceSegmentation(sent_fragments), 0)
+                fragment_end = self._fragment_start + len(sent_fragments)
+                self._sentences = self._segmentation.get_sentences(self._fragment_start, fragment_end)
+            else:
+                level_str = u" ".join(sent_fragments)
+                self._sentences = sentence_tokenizer(level_str)
         return self._sentences
 
+    def _share_segmentation(self, segmentation, fragment_start):
+        self._segmentation = segmentation
+        self._fragment_start = fragment_start
+        fragment_index = fragment_start + len([s for s in [self.chapeau, self.content] if s is not None])
+        for c in self.sublevels.values():
+            sublevel, continuation = c[0], c[1]
+            sublevel._share_segmentation(segmentation, fragment_index)
+            fragment_index += len(sublevel.get_sentence_fragments())
+            if continuation is not None:
+                fragment_index += 1
+
     def get_sentence_fragments(self):
         if self._sentence_fragments is None:
             sent_fragments = []
@@ -120,6 +198,19 @@ class Level:
             self._sentence_fragments = sent_fragments
         return self._sentence_fragments
 
+    def to_record(self):
+        # Compact, picklable form of the level hierarchy, used by the corpus cache
+        sublevel_records = [(num, c[0].to_record(), c[1]) for num, c in self.sublevels.items()]
+        return (self.id.val, self.tag, self.num, self.heading, self.chapeau, self.content, self.continuation, sublevel_records)
+
+    @staticmethod
+    def from_record(record):
+        id, tag, num, heading, chapeau, content, continuation, sublevel_records = record
+        sublevels = OrderedDict()
+        for sublevel_num, sublevel_record, sublevel_continuation in sublevel_records:
+            sublevels[sublevel_num] = [Level.from_record(sublevel_record), sublevel_continuation]
+        return Level(LevelId(id), tag, num, heading, chapeau, content, sublevels, continuation)
+
     def preorder_transversal(self):
         yield self
         for c in self.sublevels.values():
@@ -134,37 +225,435 @@ class Level:
         return unicode(self).encode("UTF-8")
 
 
+class LevelTree(object):
+    """
+    Flat, array-backed storage for a forest of levels (e.g. the sections of the IRC).
+    Node i is described by the i-th entry of each array/list, and nodes are stored in preorder,
+    so the subtree of node i is the range [i, end[i]). Use CompactLevel views to access the nodes.
+    """
+    def __init__(self):
+        # Tree structure, -1 if there is no such node
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.end = array('i')
+        self.roots = array('i')
+        # Index into TAGS
+        self.tag = array('B')
+        # Interned strings
+        self.ids = []
+        self.nums = []
+        self.keys = []
+        self._strings = dict()
+        # Text, None if missing
+        self.heading = []
+        self.chapeau = []
+        self.content = []
+        self.continuation = []
+        # Continuation following the node within its parent (see Level.sublevels)
+        self.parent_continuation = []
+        # All sentence fragments in preorder, node i owns fragments [fragment_start[i], fragment_end[i])
+        self.fragments = []
+        self.fragment_start = array('i')
+        self.fragment_end = array('i')
+        # Lazy evaluation
+        self._index_by_id = None
+        self._segmentations = dict()
+
+    @staticmethod
+    def from_records(records):
+        tree = LevelTree()
+        for record in records:
+            tree.add_record(record)
+        return tree
+
+    def _intern(self, s):
+        return self._strings.setdefault(s, s)
+
+    def add_record(self, record, parent=-1, key=None, parent_continuation=None):
+        id, tag, num, heading, chapeau, content, continuation, sublevel_records = record
+        i = len(self.ids)
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.end.append(-1)
+        if parent == -1:
+            self.roots.append(i)
+        self.tag.append(TAGS.index(tag))
+        self.ids.append(id)
+        self.nums.append(self._intern(num))
+        self.keys.append(self._intern(num if key is None else key))
+        self.heading.append(heading)
+        self.chapeau.append(chapeau)
+        self.content.append(content)
+        self.continuation.append(continuation)
+        self.parent_continuation.append(parent_continuation)
+        self.fragment_start.append(len(self.fragments))
+        self.fragment_end.append(-1)
+        for text in [chapeau, content]:
+            if text is not None:
+                self.fragments.append(text)
+        prev_child = -1
+        for sublevel_key, sublevel_record, sublevel_continuation in sublevel_records:
+            child = self.add_record(sublevel_record, parent=i, key=sublevel_key, parent_continuation=sublevel_continuation)
+            if prev_child == -1:
+                self.first_child[i] = child
+            else:
+                self.next_sibling[prev_child] = child
+            prev_child = child
+            if sublevel_continuation is not None:
+                self.fragments.append(sublevel_continuation)
+        if continuation is not None:
+            self.fragments.append(continuation)
+        self.fragment_end[i] = len(self.fragments)
+        self.end[i] = len(self.ids)
+        if parent == -1 and self._index_by_id is not None:
+            for j in xrange(i, self.end[i]):
+                self._index_by_id.setdefault(self.ids[j], j)
+        return i
+
+    def get_level(self, i):
+        return CompactLevel(self, i)
+
+    def find(self, level_id):
+        if self._index_by_id is None:
+            self._index_by_id = dict()
+            for i in xrange(len(self.ids) - 1, -1, -1):
+                self._index_by_id[self.ids[i]] = i
+        i = self._index_by_id.get(unicode(level_id))
+        if i is None:
+            raise LevelDoesNotExistException()
+        return CompactLevel(self, i)
+
+    def get_root(self, i):
+        while self.parent[i] != -1:
+            i = self.parent[i]
+        return i
+
+    def get_segmentation(self, root):
+        # Sentences are segmented once per root (e.g. section)
+        segmentation = self._segmentations.get(root)
+        if segmentation is None:
+            fragments = self.fragments[self.fragment_start[root]:self.fragment_end[root]]
+            segmentation = SentenceSegmentation(fragments)
+            self._segmentations[root] = segmentation
+        return segmentation
+
+    def children(self, i):
+        child = self.first_child[i]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def iterate_over_roots(self):
+        for i in self.roots:
+            yield CompactLevel(self, i)
+
+    def to_record(self, i):
+        sublevel_records = [(self.keys[c], self.to_record(c), self.parent_continuation[c]) for c in self.children(i)]
+        return (self.ids[i], TAGS[self.tag[i]], self.nums[i], self.heading[i], self.chapeau[i], self.content[i], self.continuation[i], sublevel_records)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class CompactLevel(object):
+    """
+    View of a node in a LevelTree, with the same interface as Level.
+    """
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def id(self):
+        return LevelId(self.tree.ids[self.index])
+
+    @property
+    def tag(self):
+        return TAGS[self.tree.tag[self.index]]
+
+    @property
+    def num(self):
+        return self.tree.nums[self.index]
+
+    @property
+    def heading(self):
+        return self.tree.heading[self.index]
+
+    @property
+    def chapeau(self):
+        return self.tree.chapeau[self.index]
+
+    @property
+    def content(self):
+        return self.tree.content[self.index]
+
+    @property
+    def continuation(self):
+        return self.tree.continuation[self.index]
+
+    @property
+    def sublevels(self):
+        sublevels = OrderedDict()
+        for c in self.tree.children(self.index):
+            sublevels[self.tree.keys[c]] = [CompactLevel(self.tree, c), self.tree.parent_continuation[c]]
+        return sublevels
+
+    def get_total_token_count(self, word_tokenizer=word_tokenize):
+        total_token_count = 0
+        for sent_fragment in self.get_sentence_fragments():
+            total_token_count += len(word_tokenizer(sent_fragment))
+        return total_token_count
+
+    def get_average_tokens_per_sentence(self, word_tokenizer=word_tokenize):
+        sentences = self.get_sentences()
+        if len(sentences) == 0:
+            return 0
+        num_tokens = 0
+        for sent in sentences:
+            num_tokens += len(word_tokenizer(sent))
+        return num_tokens / float(len(sentences))
+
+    def get_sentences(self, sentence_tokenizer=sent_tokenize):
+        if sentence_tokenizer is not sent_tokenize:
+            return sentence_tokenizer(u" ".join(self.get_sentence_fragments()))
+        root = self.tree.get_root(self.index)
+        segmentation = self.tree.get_segmentation(root)
+        base = self.tree.fragment_start[root]
+        return segmentation.get_sentences(self.tree.fragment_start[self.index] - base, self.tree.fragment_end[self.index] - base)
+
+    def get_sentence_fragments(self):
+        return self.tree.fragments[self.tree.fragment_start[self.index]:self.tree.fragment_end[self.index]]
+
+    def to_record(self):
+        return self.tree.to_record(self.index)
+
+    def preorder_transversal(self):
+        for i in xrange(self.index, self.tree.end[self.index]):
+            yield CompactLevel(self.tree, i)
+
+    def __eq__(self, other):
+        return isinstance(other, CompactLevel) and self.tree is other.tree and self.index == other.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __unicode__(self):
+        return u'\n'.join(self.get_sentences())
+
+    def __str__(self):
+        return unicode(self).encode("UTF-8")
+
+
 class IRCCrawler:
-    def __init__(self, default_namespace="USLM", debug=False):
-        self.tree = etree.parse(IRC_XML_FILEPATH)
-        self.root = self.tree.getroot()
+    def __init__(self, default_namespace="USLM", debug=False, streaming=False, use_cache=True, compact=False, xml_filepath=None):
+        # Defaults to the downloaded release point, another version of irc.xml can be given instead
+        self.xml_filepath = IRC_XML_FILEPATH if xml_filepath is None else xml_filepath
         self.default_namespace = default_namespace
-        self.nsmap = self.root.nsmap
-        self.nsmap[default_namespace] = self.nsmap.pop(None)
         self.debug = debug
+        # In streaming mode, sections are parsed one at a time with iterparse
+        self.streaming = streaming
+        # Parsed sections are read from (and written to) the corpus cache, if possible
+        self.use_cache = use_cache
+        # Levels are returned as CompactLevel views instead of Level objects
+        self.compact = compact
+        # The full tree is only loaded once it is needed
+        self.tree = None
+        self.root = None
+        self.nsmap = None
+        self._source_hash = None
+        self._identifier_index = None
+        self._corpus_index = None
+        self._section_offsets = None
+
+    def _get_root(self):
+        if self.root is None:
+            self._load_tree()
+        return self.root
+
+    def _load_tree(self):
+        self.tree = etree.parse(self.xml_filepath)
+        self.root = self.tree.getroot()
+        self._set_nsmap(self.root.nsmap)
+
+    def _set_nsmap(self, nsmap):
+        self.nsmap = dict(nsmap)
+        self.nsmap[self.default_namespace] = self.nsmap.pop(None)
 
     def _namespace_prefix(self):
+        if self.nsmap is None:
+            # Only the root element needs to be read for the namespaces
+            for _, node in etree.iterparse(self.xml_filepath, events=("start",)):
+                self._set_nsmap(node.nsmap)
+                break
         return "{{{0}}}".format(self.nsmap[self.default_namespace])
 
     def _stringify_node(self, node):
         return etree.tostring(node, method="text", encoding="UTF-8").strip().decode("UTF-8")
 
+    def _build_identifier_index(self):
+        """
+        Maps each level id to the outermost section it is in (by position in document order) and the child
+        indices leading from that section to its node(s), so that finding a level only parses its section.
+        Levels outside of sections (e.g. chapters) have no position. Also keeps the byte range of each
+        outermost section, and the namespaces to parse a section on its own with.
+        """
+        section_tag = "{0}section".format(self._namespace_prefix())
+        namespaces = None
+        levels = dict()
+        section_count = 0
+        section_depth = 0
+        for event, node in etree.iterparse(self.xml_filepath, events=("start", "end")):
+            if namespaces is None:
+                namespaces = dict((prefix or "", uri) for prefix, uri in node.nsmap.items())
+            if node.tag == section_tag:
+                section_depth += 1 if event == "start" else -1
+                if event == "end" and section_depth == 0:
+                    self._index_section_identifiers(node, section_count, levels)
+                    section_count += 1
+                    node.clear()
+                    while node.getprevious() is not None:
+                        del node.getparent()[0]
+            elif event == "start" and section_depth == 0:
+                identifier = node.get("identifier")
+                if identifier is not None and identifier.startswith(IDENTIFIER_PREFIX):
+                    levels.setdefault(identifier.replace(IDENTIFIER_PREFIX, '', 1), []).append([None, None])
+        section_ranges = self._find_section_ranges()
+        if len(section_ranges) != section_count:
+            # The raw scan was misled (e.g. by a comment), sections are found with iterparse instead
+            section_ranges = None
+        return {"namespaces": namespaces, "levels": levels, "section-ranges": section_ranges}
+
+    def _index_section_identifiers(self, section_node, position, levels):
+        stack = [(section_node, [])]
+        while len(stack) > 0:
+            node, path = stack.pop()
+            identifier = node.get("identifier")
+            if identifier is not None and identifier.startswith(IDENTIFIER_PREFIX):
+                level_id = identifier.replace(IDENTIFIER_PREFIX, '', 1)
+                levels.setdefault(level_id, []).append([position, path])
+            for i, c in enumerate(node):
+                if isinstance(c.tag, basestring):
+                    stack.append((c, path + [i]))
+
+    def _find_section_ranges(self):
+        # [start, end] byte offsets of each outermost section, in document order
+        ranges = []
+        depth = 0
+        with open(self.xml_filepath, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for m in SECTION_TAG_REGEX.finditer(data):
+                    tag_end = data.find(">", m.end()) + 1
+                    if m.group(1) == "/":
+                        depth -= 1
+                        if depth == 0:
+                            ranges[-1][1] = tag_end
+                    elif data[tag_end - 2] == "/":
+                        # Empty section
+                        if depth == 0:
+                            ranges.append([m.start(), tag_end])
+                    else:
+                        if depth == 0:
+                            ranges.append([m.start(), None])
+                        depth += 1
+            finally:
+                data.close()
+        return ranges
+
+    def _get_source_hash(self):
+        if self._source_hash is None:
+            self._source_hash = irc_cache.file_hash(self.xml_filepath)
+        return self._source_hash
+
+    def _get_identifier_index(self):
+        if self._identifier_index is None:
+            source_hash = self._get_source_hash()
+            index = irc_cache.load_json(IDENTIFIER_INDEX_FILENAME, source_hash)
+            # Indexes without section ranges are from an earlier format
+            if index is None or "section-ranges" not in index:
+                index = self._build_identifier_index()
+                irc_cache.dump_json(IDENTIFIER_INDEX_FILENAME, source_hash, index)
+            self._identifier_index = index
+        return self._identifier_index
+
+    def _get_level_nodes(self, level_ids):
+        index = self._get_identifier_index()
+        entries = []
+        for level_id in level_ids:
+            assert isinstance(level_id, LevelId)
+            level_entries = index["levels"].get(level_id.val, [])
+            assert len(level_entries) <= 1
+            if len(level_entries) == 0:
+                raise LevelDoesNotExistException()
+            entries.append(level_entries[0])
+        # Only the sections of the levels are parsed, once each
+        sections = self._parse_outermost_sections(index, set(position for position, _ in entries if position is not None))
+        nodes = []
+        for level_id, (position, path) in zip(level_ids, entries):
+            if position is None:
+                nodes.append(self._find_node(level_id))
+                continue
+            node = sections[position]
+            for i in path:
+                node = node[i]
+            nodes.append(node)
+        return nodes
+
+    def _find_node(self, level_id):
+        # Node of a level outside of sections, from the full tree
+        identifier = IDENTIFIER_PREFIX + level_id.val
+        for node in self._get_root().iter(etree.Element):
+            if node.get("identifier") == identifier:
+                return node
+        raise LevelDoesNotExistException()
+
+    def _parse_outermost_sections(self, index, positions):
+        # Position => node of the outermost sections at the given positions
+        if len(positions) == 0:
+            return dict()
+        if index["section-ranges"] is None:
+            return self._stream_outermost_sections(positions)
+        # Each section is parsed on its own, within a root declaring the namespaces of the document
+        declarations = u" ".join(u'xmlns{0}="{1}"'.format(u":" + prefix if prefix else u"", uri) for prefix, uri in index["namespaces"].items())
+        sections = dict()
+        with open(self.xml_filepath, 'rb') as f:
+            for position in positions:
+                start, end = index["section-ranges"][position]
+                f.seek(start)
+                data = f.read(end - start)
+                sections[position] = etree.fromstring(b"<root " + declarations.encode("UTF-8") + b">" + data + b"</root>")[0]
+        return sections
+
+    def _stream_outermost_sections(self, positions):
+        section_tag = "{0}section".format(self._namespace_prefix())
+        sections = dict()
+        position = 0
+        for _, node in etree.iterparse(self.xml_filepath, events=("end",), tag=section_tag):
+            if next(node.iterancestors(section_tag), None) is not None:
+                continue
+            if position in positions:
+                sections[position] = copy.deepcopy(node)
+                if len(sections) == len(positions):
+                    break
+            position += 1
+            node.clear()
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+        return sections
+
     def _get_level_node(self, level_id):
-        assert isinstance(level_id, LevelId)
-        xpath_expression = "//{0}:*[@identifier='/us/usc/t26/{1}']".format(self.default_namespace, level_id)
-        nodes = self.root.xpath(xpath_expression, namespaces=self.nsmap)
-        assert len(nodes) <= 1
-        if len(nodes) == 0:
-            raise LevelDoesNotExistException()
-        return nodes[0]
+        return self._get_level_nodes([level_id])[0]
 
     def _parse_level(self, node):
         if node.get("identifier") is None:
             # Happens for some quoted sections that appear in the "notes"
             raise LevelHasNoIdException()
-        identifier_prefix = u"/us/usc/t26/"
-        assert node.get("identifier").startswith(identifier_prefix)
-        id = LevelId(node.get("identifier").replace(identifier_prefix, '', 1))
+        assert node.get("identifier").startswith(IDENTIFIER_PREFIX)
+        id = LevelId(node.get("identifier").replace(IDENTIFIER_PREFIX, '', 1))
         ns_prefix = self._namespace_prefix()
         assert node.tag.startswith(ns_prefix)
         tag = node.tag.replace(ns_prefix, '', 1)
@@ -210,17 +699,241 @@ class IRCCrawler:
         for t in tags:
             assert t in TAGS, u"Unknown tag: {}".format(t)
         tags = ["{0}{1}".format(self._namespace_prefix(), t) for t in tags]
-        for node in self.root.iter(*tags):
+        for node in self._get_root().iter(*tags):
             yield node
 
+    def _stream_section_nodes(self):
+        section_tag = "{0}section".format(self._namespace_prefix())
+        context = etree.iterparse(self.xml_filepath, events=("end",), tag=section_tag)
+        for _, node in context:
+            if next(node.iterancestors(section_tag), None) is not None:
+                # Nested sections (e.g. quoted in notes) are yielded with their outermost section
+                continue
+            # Same (document) order as _iterate_over_nodes
+            for section_node in node.iter(section_tag):
+                yield section_node
+            # Free the finished section, along with any preceding siblings
+            node.clear()
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+        del context
+
+    def _find_section_containers(self):
+        prefix = self._namespace_prefix()
+        section_tag = "{0}section".format(prefix)
+        tags = ["{0}{1}".format(prefix, t) for t in CONTAINER_TAGS] + [section_tag]
+        containers = dict()
+        # (tag, identifier) of the containers the parser is in
+        stack = []
+        section_depth = 0
+        for event, node in etree.iterparse(self.xml_filepath, events=("start", "end"), tag=tags):
+            if node.tag == section_tag:
+                if event == "start":
+                    identifier = node.get("identifier")
+                    if section_depth == 0 and identifier is not None and identifier.startswith(IDENTIFIER_PREFIX):
+                        level_id = identifier.replace(IDENTIFIER_PREFIX, '', 1)
+                        containers.setdefault(level_id, dict((t, i) for t, i in stack if i is not None))
+                    section_depth += 1
+                else:
+                    section_depth -= 1
+                    if section_depth == 0:
+                        node.clear()
+                        while node.getprevious() is not None:
+                            del node.getparent()[0]
+            elif section_depth == 0:
+                # Containers quoted within sections are ignored
+                if event == "start":
+                    stack.append((etree.QName(node).localname, node.get("identifier")))
+                else:
+                    stack.pop()
+        return containers
+
+    def get_section_containers(self):
+        # Section id => {container tag => identifier}, for the title, subtitle, chapter, etc. each section is in
+        source_hash = self._get_source_hash()
+        containers = irc_cache.load_json(SECTION_CONTAINERS_FILENAME, source_hash)
+        if containers is None:
+            containers = self._find_section_containers()
+            irc_cache.dump_json(SECTION_CONTAINERS_FILENAME, source_hash, containers)
+        return containers
+
+    def _get_corpus_index(self):
+        if not self.use_cache:
+            return None
+        if self._corpus_index is None:
+            self._corpus_index = irc_cache.load_json(CORPUS_INDEX_FILENAME, self._get_source_hash())
+        return self._corpus_index
+
+    def _get_cached_levels(self, level_ids):
+        corpus_index = self._get_corpus_index()
+        if corpus_index is None:
+            return [None]*len(level_ids)
+        if self._section_offsets is None:
+            self._section_offsets = dict()
+            for section_id, offset, _ in corpus_index["sections"]:
+                self._section_offsets.setdefault(section_id, offset)
+        section_offsets = [self._section_offsets.get(level_id.get_section_id()) for level_id in level_ids]
+        offsets = sorted(set(offset for offset in section_offsets if offset is not None))
+        records = irc_cache.read_records(corpus_index["records"], offsets)
+        # Level id => level, for each section read, so that each id is a lookup (the first level with it wins)
+        section_levels = dict()
+        for offset, record in zip(offsets, records):
+            levels_by_id = dict()
+            for level in _level_from_record(self.compact, record).preorder_transversal():
+                levels_by_id.setdefault(level.id.val, level)
+            section_levels[offset] = levels_by_id
+        return [section_levels[offset].get(level_id.val) if offset is not None else None
+                for level_id, offset in zip(level_ids, section_offsets)]
+
     def get_level(self, level_id):
-        level_id = LevelId(level_id)
-        level_node = self._get_level_node(level_id)
-        level = self._parse_level(level_node)
-        return level
+        return self.get_levels([level_id])[0]
+
+    def get_levels(self, level_ids):
+        level_ids = [LevelId(level_id) for level_id in level_ids]
+        levels = self._get_cached_levels(level_ids)
+        # Levels outside the cached sections (e.g. repealed sections) are parsed from the XML
+        missing = [i for i, level in enumerate(levels) if level is None]
+        if len(missing) > 0:
+            level_nodes = self._get_level_nodes([level_ids[i] for i in missing])
+            for i, level_node in zip(missing, level_nodes):
+                levels[i] = self._parse_level(level_node)
+                if self.compact:
+                    levels[i] = _level_from_record(self.compact, levels[i].to_record())
+        return levels
+
+    def load_level_tree(self):
+        # All sections, in a single LevelTree
+        tree = LevelTree()
+        corpus_index = self._get_corpus_index()
+        if corpus_index is not None:
+            for record in irc_cache.read_records(corpus_index["records"]):
+                tree.add_record(record)
+        else:
+            for section in self.iterate_over_sections():
+                tree.add_record(section.to_record())
+        return tree
+
+    def build_corpus_cache(self):
+        for _ in self.iterate_over_sections():
+            pass
+
+    def _ensure_corpus_cache(self):
+        if self._get_corpus_index() is None:
+            self.use_cache = True
+            self.build_corpus_cache()
+        return self._get_corpus_index()
+
+    def get_section_hashes(self):
+        # Section id => content hash, for every section iterate_over_sections yields
+        section_hashes = OrderedDict()
+        for section_id, _, section_hash in self._ensure_corpus_cache()["sections"]:
+            section_hashes.setdefault(section_id, section_hash)
+        return section_hashes
+
+    def map_sections(self, func, processes=None, shard_size=16, results_filename=None, reuse_results=True, text=False):
+        """
+        Applies func to every section (as iterate_over_sections would yield them) on a pool of processes,
+        yielding the results in document order. func must be picklable, e.g. a module-level function.
+        Workers load their sections from the corpus cache, which is built first if needed.
+        With text=True, func is instead called with the section id and a zero-copy buffer of the section's
+        UTF-8 text (its sentence fragments joined by spaces), which workers read from the memory-mapped
+        text store (see text_store.py) without unpickling the section.
+        If results_filename is given, results are stored there by section content hash, and only sections
+        whose hash has no stored result (e.g. those changed by a new release point) are processed. The
+        filename should include a hash of the code of func (see irc_cache.code_hash); a hash of the code
+        that reads sections (this module, and text_store.py with text=True) is added to it here.
+        """
+        corpus_index = self._ensure_corpus_cache()
+        if text:
+            # Imported here, since text_store imports this module
+            import text_store
+        if results_filename is not None:
+            code_filepaths = [__file__, text_store.__file__] if text else [__file__]
+            base, extension = splitext(results_filename)
+            results_filename = "{0}-{1}{2}".format(base, irc_cache.code_hash(*code_filepaths), extension)
+        stored_results = dict()
+        if results_filename is not None and reuse_results:
+            stored_results = irc_cache.load_pickle(results_filename) or dict()
+        if text:
+            # Built (if needed) before the workers start, from the same sections in the same order
+            assert len(text_store.load_text_store(self).sections) == len(corpus_index["sections"])
+            pending_sections = [(i, section_id) for i, (section_id, _, section_hash) in enumerate(corpus_index["sections"]) if section_hash not in stored_results]
+            pending_results = self._map_tasks(_map_section_text_shard, [(func, self.xml_filepath, pending_sections[i:i+shard_size]) for i in xrange(0, len(pending_sections), shard_size)], processes)
+        else:
+            pending_offsets = [offset for _, offset, section_hash in corpus_index["sections"] if section_hash not in stored_results]
+            pending_results = self._map_section_offsets(func, corpus_index["records"], pending_offsets, processes, shard_size)
+        results = dict()
+        for _, _, section_hash in corpus_index["sections"]:
+            if section_hash in stored_results:
+                result = stored_results[section_hash]
+            else:
+                result = next(pending_results)
+            results[section_hash] = result
+            yield result
+        if results_filename is not None:
+            irc_cache.dump_pickle(results_filename, results)
+
+    def _map_section_offsets(self, func, records_filename, offsets, processes, shard_size):
+        tasks = [(func, records_filename, offsets[i:i+shard_size], self.compact) for i in xrange(0, len(offsets), shard_size)]
+        return self._map_tasks(_map_section_shard, tasks, processes)
+
+    def _map_tasks(self, shard_func, tasks, processes):
+        # Results of shard_func over the tasks, flattened in order
+        if processes == 1:
+            for task in tasks:
+                for result in shard_func(task):
+                    yield result
+            return
+        pool = Pool(processes)
+        try:
+            for results in pool.imap(shard_func, tasks):
+                for result in results:
+                    yield result
+        except BaseException:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
 
     def iterate_over_sections(self):
-        for node in self._iterate_over_nodes(tags=["section"]):
+        corpus_index = self._get_corpus_index()
+        if corpus_index is not None:
+            for record in irc_cache.read_records(corpus_index["records"]):
+                yield _level_from_record(self.compact, record)
+            return
+        sections = self._parse_sections()
+        if self.use_cache:
+            sections = self._cache_sections(sections)
+        for section in sections:
+            if self.compact:
+                section = _level_from_record(self.compact, section.to_record())
+            yield section
+
+    def _cache_sections(self, sections):
+        source_hash = self._get_source_hash()
+        records_filename = "corpus-{0}.pkl".format(source_hash)
+        writer = irc_cache.RecordWriter(records_filename)
+        section_offsets = []
+        try:
+            for section in sections:
+                record = section.to_record()
+                section_offsets.append([section.id.val, writer.write(record), _record_hash(record)])
+                yield section
+        except BaseException:
+            # Includes GeneratorExit, when the caller stops before the last section
+            writer.abort()
+            raise
+        writer.commit()
+        corpus_index = {"records": records_filename, "sections": section_offsets}
+        irc_cache.dump_json(CORPUS_INDEX_FILENAME, source_hash, corpus_index)
+        self._corpus_index = corpus_index
+
+    def _parse_sections(self):
+        if self.streaming:
+            nodes = self._stream_section_nodes()
+        else:
+            nodes = self._iterate_over_nodes(tags=["section"])
+        for node in nodes:
             if node.get("status") in ["repealed", "omitted"]:
                 # Skip "repealed" (288 counted) and "omitted" (2 counted) sections
                 # Other statuses are "renumbered" (17 counted) and "reserved" (2 counted)
@@ -249,9 +962,42 @@ class IRCCrawler:
     #         levels.append(level)
     #     return levels
 
+def _record_hash(record):
+    return hashlib.sha1(json.dumps(record, separators=(',', ':'))).hexdigest()
+
+def compare_section_hashes(old_section_hashes, new_section_hashes):
+    # Change manifest between two versions of the IRC, with section ids in document order
+    return {
+        "added": [s for s in new_section_hashes if s not in old_section_hashes],
+        "removed": [s for s in old_section_hashes if s not in new_section_hashes],
+        "changed": [s for s in new_section_hashes if s in old_section_hashes and new_section_hashes[s] != old_section_hashes[s]],
+        "unchanged": [s for s in new_section_hashes if s in old_section_hashes and new_section_hashes[s] == old_section_hashes[s]]
+    }
+
+def _level_from_record(compact, record):
+    if compact:
+        return LevelTree.from_records([record]).get_level(0)
+    return Level.from_record(record)
+
+def _map_section_shard(task):
+    func, records_filename, offsets, compact = task
+    records = irc_cache.read_records(records_filename, offsets)
+    return [func(_level_from_record(compact, record)) for record in records]
+
+# xml filepath => TextStore, opened once per worker process
+_text_stores = dict()
+
+def _map_section_text_shard(task):
+    import text_store
+    func, xml_filepath, sections = task
+    if xml_filepath not in _text_stores:
+        _text_stores[xml_filepath] = text_store.load_text_store(IRCCrawler(streaming=True, compact=True, xml_filepath=xml_filepath))
+    store = _text_stores[xml_filepath]
+    return [func(section_id, store.get_section_buffer(i)) for i, section_id in sections]
+
 def validate_sections(crawler=None):
     if crawler is None:
-        crawler = IRCCrawler()
+        crawler = IRCCrawler(streaming=True)
     count = 0
     for section in crawler.iterate_over_sections():
         count += 1
@@ -259,7 +1005,7 @@ def validate_sections(crawler=None):
 
 def get_sections_ordered_by_average_tokens_per_sentence(crawler=None):
     if crawler is None:
-        crawler = IRCCrawler()
+        crawler = IRCCrawler(streaming=True)
     section_num_avg_tokens_per_sent_pairs = []
     for section in crawler.iterate_over_sections():
         average_tokens_per_sentence = section.get_average_tokens_per_sentence()
@@ -269,7 +1015,9 @@ def get_sections_ordered_by_average_tokens_per_sentence(crawler=None):
 
 
 def main(args):
-    crawler = IRCCrawler()
+    crawler = IRCCrawler(streaming=True, use_cache=not args.no_cache)
+    if args.build_cache:
+        crawler.build_corpus_cache()
     level = crawler.get_level(args.level_id)
     print(level)
     # levels = crawler.find_levels_by_text("general", args.level_id, tag="heading")
@@ -288,6 +1036,12 @@ if __name__ == "__main__":
                         help="Specifies the level (section, subsection, paragraph, etc.) to find. " + \
                               "Should have pattern s[section]/[subsection]/[paragraph]/[subparagraph]/[clause]/[subclause]/[item]/[subitem]/[subsubitem]. " + \
                               "For example, 's163/h/1' specifies section 163, subsection h, paragraph 1.")
+    parser.add_argument("--build-cache",
+                        action="store_true",
+                        help="Parse all sections into the corpus cache (in irc/cache), so that later runs skip XML parsing.")
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="Always parse levels from the XML, ignoring the corpus cache.")
     args = parser.parse_args()
     main(args)
 
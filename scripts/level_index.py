@@ -0,0 +1,158 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+import irc_cache
+import irc_crawler
+
+
+TOKEN_REGEX = re.compile(r"\w+", re.UNICODE)
+# Fields of a level that are indexed
+HEADING = 0
+TEXT = 1
+# Source hash => LevelIndex, so the index is loaded once per process
+_level_indexes = dict()
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall(text.lower())
+
+def get_own_text_fragments(level):
+    # Text of the level itself, excluding its sublevels (continuations between sublevels belong to the level)
+    fragments = [level.chapeau, level.content]
+    fragments += [c[1] for c in level.sublevels.values()]
+    fragments += [level.continuation]
+    return [f for f in fragments if f is not None]
+
+
+class LevelIndex(object):
+    """
+    Positional inverted index over the headings and text of all levels, used to find levels by keyword
+    or phrase. A posting is a level (by position in document order) and a token position,
+    with the field (heading or text) in the lowest bit of the position.
+    """
+    def __init__(self, level_ids, postings):
+        # Level ids in document order
+        self.level_ids = level_ids
+        # Term => (levels, positions), as array strings so that loading the index is fast
+        self._postings = postings
+        self._decoded = dict()
+
+    @staticmethod
+    def build(crawler=None):
+        if crawler is None:
+            crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+        level_ids = []
+        postings = dict()
+        for section in crawler.iterate_over_sections():
+            for level in section.preorder_transversal():
+                level_index = len(level_ids)
+                level_ids.append(level.id.val)
+                fields = [(HEADING, [level.heading] if level.heading is not None else []), (TEXT, get_own_text_fragments(level))]
+                for field, fragments in fields:
+                    position = 0
+                    for fragment in fragments:
+                        for token in tokenize(fragment):
+                            if token not in postings:
+                                postings[token] = (array('i'), array('i'))
+                            postings[token][0].append(level_index)
+                            postings[token][1].append(2*position + field)
+                            position += 1
+                        # Phrases should not match across fragments
+                        position += 1
+        postings = dict((term, (levels.tostring(), positions.tostring())) for term, (levels, positions) in postings.items())
+        return level_ids, postings
+
+    def _get_postings(self, term):
+        if term not in self._decoded:
+            levels, positions = array('i'), array('i')
+            if term in self._postings:
+                levels.fromstring(self._postings[term][0])
+                positions.fromstring(self._postings[term][1])
+            self._decoded[term] = (levels, positions)
+        return self._decoded[term]
+
+    def _has_posting(self, postings, level, position):
+        # Postings are sorted by level, so the positions of a level are found by bisection
+        levels, positions = postings
+        start = bisect_left(levels, level)
+        end = bisect_right(levels, level, start)
+        return position in positions[start:end]
+
+    def _find(self, terms, field):
+        # Levels (by position in document order) where terms appear consecutively, in the given field (or any if None)
+        postings = [self._get_postings(term) for term in terms]
+        # Candidates come from the rarest term, and are checked against the positions of the others
+        rarest = min(range(len(terms)), key=lambda offset: len(postings[offset][0]))
+        matches = []
+        for level, position in zip(*postings[rarest]):
+            if field is not None and position % 2 != field:
+                continue
+            if len(matches) > 0 and matches[-1] == level:
+                continue
+            start = position - 2*rarest
+            if all(self._has_posting(postings[offset], level, start + 2*offset) for offset in range(len(terms)) if offset != rarest):
+                matches.append(level)
+        return matches
+
+    def search(self, query, heading_only=False, scope_level_id=None):
+        """
+        Returns the LevelIds, in document order, of levels whose own heading or text contains the query
+        (a term or a phrase). Optionally restricted to headings, and to the levels within the given scope.
+        """
+        terms = tokenize(query)
+        if len(terms) == 0:
+            return []
+        levels = self._find(terms, HEADING if heading_only else None)
+        level_ids = [self.level_ids[level] for level in levels]
+        if scope_level_id is not None:
+            scope = unicode(scope_level_id)
+            level_ids = [l for l in level_ids if l == scope or l.startswith(scope + u"/")]
+        return [irc_crawler.LevelId(l) for l in level_ids]
+
+
+def load_level_index(crawler=None):
+    if crawler is None:
+        crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+    source_hash = irc_cache.file_hash(crawler.xml_filepath)
+    if source_hash not in _level_indexes:
+        index_filename = "level_index-{0}.pkl".format(source_hash)
+        level_index = irc_cache.load_pickle(index_filename)
+        if level_index is None:
+            # Built from a streaming crawler over the same file, however the given crawler reads it
+            level_index = LevelIndex.build(irc_crawler.IRCCrawler(streaming=True, compact=True, xml_filepath=crawler.xml_filepath))
+            irc_cache.dump_pickle(index_filename, level_index)
+        level_ids, postings = level_index
+        _level_indexes[source_hash] = LevelIndex(level_ids, postings)
+    return _level_indexes[source_hash]
+
+def find_levels_by_text(text, scope_level_id, heading_only=False, crawler=None):
+    if crawler is None:
+        crawler = irc_crawler.IRCCrawler()
+    level_ids = load_level_index(crawler).search(text, heading_only=heading_only, scope_level_id=scope_level_id)
+    return crawler.get_levels([level_id.val for level_id in level_ids])
+
+
+def main(args):
+    level_index = load_level_index()
+    level_ids = level_index.search(args.query.decode("UTF-8"), heading_only=args.heading_only, scope_level_id=args.level_id)
+    for level_id in level_ids:
+        print(level_id)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Find levels of the Internal Revenue Code by keyword or phrase.")
+    parser.add_argument("query",
+                        type=str,
+                        help="Term or phrase to look for, e.g. 'interest' or 'qualified residence interest'.")
+    parser.add_argument("--heading-only",
+                        action="store_true",
+                        help="Only look for the query in level headings.")
+    parser.add_argument("--level-id",
+                        type=str,
+                        default=None,
+                        help="Only look for the query within this level (section, subsection, paragraph, etc.). " + \
+                              "Should have pattern s[section]/[subsection]/[paragraph]/[subparagraph]/[clause]/[subclause]/[item]/[subitem]/[subsubitem]. " + \
+                              "For example, 's163/h/1' specifies section 163, subsection h, paragraph 1.")
+    args = parser.parse_args()
+    main(args)
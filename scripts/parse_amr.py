@@ -1,22 +1,62 @@
 import os
 from os.path import dirname, join, realpath
+import atexit
+import json
+import shutil
 import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import amr_utils
+import irc_cache
+from response_cache import ResponseCache, cache_key
 
 
 CORNELL_AMR_DIR = join(dirname(dirname(realpath(__file__))), "tools/cornell-amr")
+CORNELL_AMR_MODEL_FILEPATH = join(CORNELL_AMR_DIR, "amr.sp")
+# Where Cornell AMR writes parse.out, relative to its root directory
+CORNELL_AMR_OUTPUT_DIR = join("experiments", "parse", "logs")
 CAMR_DIR = join(dirname(dirname(realpath(__file__))), "tools/camr")
+CAMR_MODEL_FILEPATH = join(CAMR_DIR, "amr-anno-1.0.train.basic-abt-brown-verb.m")
+CAMR_WORKER_FILEPATH = join(dirname(realpath(__file__)), "camr_worker.py")
+CACHE_DIR = join(dirname(dirname(realpath(__file__))), "cache/amr")
+MODEL_FILEPATHS = {
+    "cornell-amr": CORNELL_AMR_MODEL_FILEPATH,
+    "camr": CAMR_MODEL_FILEPATH
+}
 
 
-def prepare_input_file(filedir, sentences):
-    assert filedir in [CORNELL_AMR_DIR, CAMR_DIR]
-    input_filepath = "{0}/sentences.txt".format(filedir)
-    os.system("rm {0}{1}".format(input_filepath, "*"))
+def make_work_dir(parser):
+    # Private directory for the files of one call, so that concurrent calls do not overwrite each other's
+    return tempfile.mkdtemp(prefix="{0}-".format(parser))
+
+def remove_work_dir(work_dir, debug=False):
+    if debug:
+        print("Info: Parser files kept in {0}".format(work_dir))
+        return
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+def prepare_input_file(work_dir, sentences):
+    input_filepath = join(work_dir, "sentences.txt")
     with open(input_filepath, 'w') as f:
         content = u'\n'.join(sentences)
         f.write(content.encode("UTF-8"))
     return input_filepath
 
+def link_tree(source_dir, target_dir, private_relpath):
+    # Mirrors source_dir in target_dir with symbolic links, except for the directories on private_relpath, which are created
+    components = private_relpath.split(os.sep)
+    for name in os.listdir(source_dir):
+        if name != components[0]:
+            os.symlink(join(source_dir, name), join(target_dir, name))
+            continue
+        os.mkdir(join(target_dir, name))
+        if len(components) > 1:
+            link_tree(join(source_dir, name), join(target_dir, name), join(*components[1:]))
+    if not os.path.exists(join(target_dir, private_relpath)):
+        os.makedirs(join(target_dir, private_relpath))
+
 def cornell_amr_parse(sentences, debug=False):
     if debug:
         stdout = None
@@ -26,33 +66,130 @@ def cornell_amr_parse(sentences, debug=False):
         stdout = open(os.devnull, 'w')
         stderr = subprocess.STDOUT
         log_level = "ERROR"
-    input_filepath = prepare_input_file(CORNELL_AMR_DIR, sentences)
+    # Cornell AMR writes its output under its root directory, so each call runs in a linked copy of it
+    work_dir = make_work_dir("cornell-amr")
+    try:
+        link_tree(CORNELL_AMR_DIR, work_dir, CORNELL_AMR_OUTPUT_DIR)
+        input_filepath = prepare_input_file(work_dir, sentences)
+        return _cornell_amr_parse_file(work_dir, input_filepath, stdout, stderr, log_level)
+    finally:
+        remove_work_dir(work_dir, debug)
+
+def _cornell_amr_parse_file(root_dir, input_filepath, stdout, stderr, log_level):
     args = [
         "java",
         "-Xmx8g",
         "-jar",
         "{0}/dist/amr-1.0.jar".format(CORNELL_AMR_DIR),
         "parse",
-        "rootDir={0}".format(CORNELL_AMR_DIR),
-        "modelFile={0}/amr.sp".format(CORNELL_AMR_DIR),
+        "rootDir={0}".format(root_dir),
+        "modelFile={0}".format(CORNELL_AMR_MODEL_FILEPATH),
         "sentences={0}".format(input_filepath),
         "logLevel={0}".format(log_level)
     ]
-    process = subprocess.Popen(args, cwd=CORNELL_AMR_DIR, stdout=stdout, stderr=stderr)
+    process = subprocess.Popen(args, cwd=root_dir, stdout=stdout, stderr=stderr)
     process.wait()
     assert process.returncode == 0, "Cornell AMR execution failed."
-    output_filepath = "{0}/experiments/parse/logs/parse.out".format(CORNELL_AMR_DIR)
+    output_filepath = join(root_dir, CORNELL_AMR_OUTPUT_DIR, "parse.out")
     output = amr_utils.read_from_file(output_filepath)
     return output
 
-def camr_parse(sentences, debug=False):
+class CAMRWorker(object):
+    """
+    CAMR in a long-lived process (see camr_worker.py), which loads the model and preprocessing parsers once and
+    then parses the sentence file of each request, so a call costs the parse instead of the interpreter and model startup.
+    Requests are sent one at a time; the process is started on the first request and again if it exits.
+    """
+    def __init__(self, debug=False):
+        self.debug = debug
+        self._process = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        stderr = None if self.debug else open(os.devnull, 'w')
+        args = [
+            "python",
+            CAMR_WORKER_FILEPATH,
+            "--camr-dir",
+            CAMR_DIR,
+            "--model",
+            CAMR_MODEL_FILEPATH
+        ]
+        self._process = subprocess.Popen(args, cwd=CAMR_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
+        response = self._receive()
+        assert response.get("ready"), "CAMR worker failed to start."
+
+    def _receive(self):
+        line = self._process.stdout.readline()
+        if line == "":
+            self._process.wait()
+            self._process = None
+            raise AssertionError("CAMR worker exited.")
+        return json.loads(line)
+
+    def parse_file(self, input_filepath):
+        # Returns the path of the parsed output
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            self._process.stdin.write(json.dumps({"input_filepath": input_filepath}) + "\n")
+            self._process.stdin.flush()
+            response = self._receive()
+        assert "error" not in response, "CAMR parsing failed.\n{0}".format(response.get("error"))
+        return response["output_filepath"]
+
+    def close(self):
+        with self._lock:
+            if self._process is not None:
+                self._process.stdin.close()
+                self._process.wait()
+                self._process = None
+
+# debug => idle CAMRWorkers; a call takes one (or starts a new one) and puts it back when done
+_idle_camr_workers = dict()
+_camr_workers = []
+_camr_workers_lock = threading.Lock()
+
+def acquire_camr_worker(debug=False):
+    with _camr_workers_lock:
+        idle_workers = _idle_camr_workers.setdefault(debug, [])
+        if len(idle_workers) > 0:
+            return idle_workers.pop()
+        worker = CAMRWorker(debug=debug)
+        _camr_workers.append(worker)
+        return worker
+
+def release_camr_worker(worker):
+    with _camr_workers_lock:
+        _idle_camr_workers[worker.debug].append(worker)
+
+@atexit.register
+def close_workers():
+    for worker in _camr_workers:
+        worker.close()
+
+def camr_parse(sentences, debug=False, persistent=True):
+    work_dir = make_work_dir("camr")
+    try:
+        input_filepath = prepare_input_file(work_dir, sentences)
+        if persistent:
+            worker = acquire_camr_worker(debug)
+            try:
+                output_filepath = worker.parse_file(input_filepath)
+            finally:
+                release_camr_worker(worker)
+            return amr_utils.read_from_file(output_filepath)
+        return _camr_parse_file(input_filepath, debug)
+    finally:
+        remove_work_dir(work_dir, debug)
+
+def _camr_parse_file(input_filepath, debug=False):
     if debug:
         stdout = None
         stderr = None
     else:
         stdout = open(os.devnull, 'w')
         stderr = subprocess.STDOUT
-    input_filepath = prepare_input_file(CAMR_DIR, sentences)
     args = [
         "python",
         "{0}/amr_parsing.py".format(CAMR_DIR),
@@ -69,7 +206,7 @@ def camr_parse(sentences, debug=False):
         "-m",
         "parse",
         "--model",
-        "{0}/amr-anno-1.0.train.basic-abt-brown-verb.m".format(CAMR_DIR),
+        CAMR_MODEL_FILEPATH,
         input_filepath
     ]
     process = subprocess.Popen(args, cwd=CAMR_DIR, stdout=stdout, stderr=stderr)
@@ -79,12 +216,71 @@ def camr_parse(sentences, debug=False):
     output = amr_utils.read_from_file(output_filepath)
     return output
 
-def parse_amr(sentences, parser="camr", debug=False):
-	if parser == "cornell-amr":
-		return cornell_amr_parse(sentences, debug=debug)
-	if parser == "camr":
-		return camr_parse(sentences, debug=debug)
-	raise Exception("Unknown parser: {0}".format(parser))
+def normalize_sentence(sentence):
+    return u" ".join(sentence.split())
+
+# Cache directory => ResponseCache
+_caches = dict()
+
+def get_cache(cache_dir):
+    if cache_dir not in _caches:
+        _caches[cache_dir] = ResponseCache(cache_dir)
+    return _caches[cache_dir]
+
+def parse_amr(sentences, parser="camr", debug=False, persistent=True, shards=1, cache_dir=CACHE_DIR):
+    """
+    Parses the sentences to AMRs. AMRs are cached on disk by normalized sentence, parser and hash of the
+    model file, unless cache_dir is None; the sentences not in the cache are parsed in a single call.
+    """
+    if parser not in MODEL_FILEPATHS:
+        raise Exception("Unknown parser: {0}".format(parser))
+    if cache_dir is None:
+        return _parse_amr(sentences, parser, debug, persistent, shards)
+    cache = get_cache(cache_dir)
+    model_hash = irc_cache.file_hash(MODEL_FILEPATHS[parser])
+    keys = [cache_key("amr", parser, model_hash, normalize_sentence(sentence)) for sentence in sentences]
+    amrs = [None]*len(sentences)
+    # Key => sentence, for the sentences not in the cache (once each)
+    missing = OrderedDict()
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is not None:
+            amrs[i] = cached["amr"]
+        elif key not in missing:
+            missing[key] = sentences[i]
+    if len(missing) > 0:
+        parsed_amrs = _parse_amr(missing.values(), parser, debug, persistent, shards)
+        assert len(parsed_amrs) == len(missing), "{0} AMRs parsed for {1} sentences.".format(len(parsed_amrs), len(missing))
+        parsed = dict(zip(missing.keys(), parsed_amrs))
+        for key, amr in parsed.items():
+            cache.put(key, {"amr": amr})
+        for i, key in enumerate(keys):
+            if amrs[i] is None:
+                amrs[i] = parsed[key]
+    return amrs
+
+def _parse_amr(sentences, parser, debug, persistent, shards):
+    """
+    With shards > 1, the sentences are split into that many runs of consecutive sentences, parsed by
+    concurrent parser processes, and the AMRs are merged back in order.
+    """
+    if parser == "cornell-amr":
+        parse = lambda shard: cornell_amr_parse(shard, debug=debug)
+    elif parser == "camr":
+        parse = lambda shard: camr_parse(shard, debug=debug, persistent=persistent)
+    shards = max(1, min(shards, len(sentences)))
+    if shards == 1:
+        return parse(sentences)
+    # Shard sizes differ by at most one sentence
+    bounds = [len(sentences)*i//shards for i in xrange(shards + 1)]
+    sentence_shards = [sentences[start:end] for start, end in zip(bounds, bounds[1:])]
+    pool = ThreadPool(len(sentence_shards))
+    try:
+        amr_shards = pool.map(parse, sentence_shards)
+    finally:
+        pool.close()
+        pool.join()
+    return [amr for amrs in amr_shards for amr in amrs]
 
 if __name__ == "__main__":
     sentences = ["Every man loves a woman.", "Every man has a cat."]
@@ -1,5 +1,8 @@
 # This Python file uses the following encoding: UTF-8
 import re
+import hashlib
+from functools import partial
+import irc_cache
 import irc_crawler
 
 
@@ -47,16 +50,56 @@ TERM_REGEX2 = regex(ur"the term (?:(“[^”]+”)|(‘[^’]+’))")
 TERM_REGEX3 = regex(ur"the term (?:(“[^”]+”)|(‘[^’]+’)) {0}".format(ALL_DEFINITION_TYPES_PATTERN))
 
 
-def count_pattern_matches(patterns):
-    crawler = irc_crawler.IRCCrawler()
-    num_patterns = len(patterns)
-    match_counts = [0]*num_patterns
-    for section in crawler.iterate_over_sections():
-        text = u" ".join(section.get_sentences())
-        for i in xrange(num_patterns):
-            pattern = patterns[i]
-            matches = pattern.findall(text)
-            match_counts[i] += len(matches)
+# Every match of the patterns above contains this (case-insensitively), so only text containing it is scanned
+PREFILTER = u"the term"
+
+
+def prefilter_regex(prefilter):
+    # Case-insensitive search for the prefilter, directly on the UTF-8 text if the prefilter is ASCII
+    if all(ord(c) < 128 for c in prefilter):
+        return re.compile(re.escape(prefilter.encode("UTF-8")), re.IGNORECASE)
+    return regex(re.escape(prefilter))
+
+def count_section_matches(patterns, prefilter, section_id, text):
+    # text is a buffer of the section's UTF-8 text (see IRCCrawler.map_sections), only decoded if needed
+    if prefilter is not None:
+        if isinstance(prefilter.pattern, unicode):
+            text = unicode(text, "UTF-8")
+        if prefilter.search(text) is None:
+            # Most sections have no candidates, and cost one scan of the mapped text
+            return section_id, [0]*len(patterns)
+    if not isinstance(text, unicode):
+        text = unicode(text, "UTF-8")
+    return section_id, [len(pattern.findall(text)) for pattern in patterns]
+
+def count_section_pattern_matches(patterns, prefilter=PREFILTER, processes=None, reuse_results=True):
+    """
+    Yields (section id, match count of each pattern) for every section, in document order. Sections are
+    counted in parallel, on the section text in the text store. If prefilter is given, it must be in every
+    match of every pattern, e.g. PREFILTER for the term definition patterns, and sections without it are
+    not scanned with the patterns.
+    """
+    crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+    # Counts per section are reused for unchanged sections, as long as the patterns (and this module) are the same
+    patterns_key = [prefilter or u"", irc_cache.code_hash(__file__).decode("ascii")] + [pattern.pattern for pattern in patterns]
+    patterns_hash = hashlib.sha1(u"\n".join(patterns_key).encode("UTF-8")).hexdigest()
+    results_filename = "pattern_counts_text_results-{0}.pkl".format(patterns_hash)
+    if prefilter is not None:
+        prefilter = prefilter_regex(prefilter)
+    return crawler.map_sections(partial(count_section_matches, patterns, prefilter),
+                                processes=processes,
+                                results_filename=results_filename,
+                                reuse_results=reuse_results,
+                                text=True)
+
+def count_pattern_matches(patterns, prefilter=PREFILTER, processes=None, reuse_results=True, section_match_counts=None):
+    # Total counts per pattern, optionally appending the (section id, counts) of sections with matches to section_match_counts
+    match_counts = [0]*len(patterns)
+    for section_id, counts in count_section_pattern_matches(patterns, prefilter, processes, reuse_results):
+        for i, count in enumerate(counts):
+            match_counts[i] += count
+        if section_match_counts is not None and any(count > 0 for count in counts):
+            section_match_counts.append((section_id, counts))
     return match_counts
 
 def prepare_output(patterns, match_counts):
@@ -70,14 +113,33 @@ def prepare_output(patterns, match_counts):
         output.append(u"MATCH COUNT #{0}: {1}\n".format(i, match_count))
     return u"\n".join(output)
 
+def prepare_section_output(section_match_counts):
+    output = []
+    for section_id, counts in section_match_counts:
+        output.append(u"{0}\t{1}".format(section_id, u"\t".join(unicode(count) for count in counts)))
+    return u"\n".join(output)
+
 def main(args):
-    patterns = [TERM_REGEX1, TERM_REGEX2, TERM_REGEX3]
-    patterns += LEAD_INS_REGEXS
-    patterns += TERM_DEFINITION_REGEXS
-    match_counts = count_pattern_matches(patterns)
+    if args.pattern is not None:
+        patterns = [regex(pattern.decode("UTF-8")) for pattern in args.pattern]
+        prefilter = args.prefilter.decode("UTF-8") if args.prefilter is not None else None
+    else:
+        patterns = [TERM_REGEX1, TERM_REGEX2, TERM_REGEX3]
+        patterns += LEAD_INS_REGEXS
+        patterns += TERM_DEFINITION_REGEXS
+        prefilter = PREFILTER
+    section_match_counts = []
+    match_counts = count_pattern_matches(patterns,
+                                         prefilter=prefilter,
+                                         processes=args.processes,
+                                         reuse_results=not args.recompute,
+                                         section_match_counts=section_match_counts)
     output = prepare_output(patterns, match_counts)
     with open(args.output_file, 'w') as f:
         f.write(output.encode("UTF-8"))
+    if args.section_output_file is not None:
+        with open(args.section_output_file, 'w') as f:
+            f.write(prepare_section_output(section_match_counts).encode("UTF-8"))
 
 
 if __name__ == "__main__":
@@ -86,5 +148,25 @@ if __name__ == "__main__":
     parser.add_argument("--output-file",
                         type=str,
                         default="pattern_counts.txt")
+    parser.add_argument("--section-output-file",
+                        type=str,
+                        default=None,
+                        help="Also write the match count of each pattern for every section with matches (tab separated).")
+    parser.add_argument("--pattern",
+                        type=str,
+                        action="append",
+                        default=None,
+                        help="Count matches of this pattern (case-insensitive) instead of the term definition patterns. Can be repeated.")
+    parser.add_argument("--prefilter",
+                        type=str,
+                        default=None,
+                        help="Text that every match of the given patterns contains (case-insensitive), so that sections without it are skipped, e.g. 'the term'.")
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of processes to count matches with (defaults to the number of cores).")
+    parser.add_argument("--recompute",
+                        action="store_true",
+                        help="Count matches in all sections, instead of reusing counts for unchanged sections.")
     args = parser.parse_args()
     main(args)
@@ -1,6 +1,8 @@
 import irc_crawler
 import definition_extractor
+import definition_scope
 import rule_extractor
+import clause_splitter
 import candc_boxer_api
 import parse_amr
 import default_logic
@@ -8,14 +10,17 @@ import amr2fol
 from nltk.sem.logic import Expression
 
 
-def parse_fol(sentences):
-    ccboxer = candc_boxer_api.CCBoxerAPI()
+def parse_fol(sentences, ccboxer=None):
+    if ccboxer is None:
+        ccboxer = candc_boxer_api.CCBoxerAPI()
     # drss = ccboxer.interpret(sentences)
-    # Hack to make sure this doesn't fail because input is too large
-    drss = [ccboxer.interpret([sentence]) for sentence in sentences]
+    # Sentences are batched adaptively, so that input that is too large is split up instead of failing
+    drss = ccboxer.interpret_batched(sentences)
     # results = [drs.fol() for drs in drss]
     results = []
     for drs in drss:
+        if isinstance(drs, candc_boxer_api.CCBoxerAPIException):
+            raise drs
         assert len(drs) == 1
         results.append(drs[0].fol())
     return results
@@ -28,6 +33,8 @@ def stringify_output(sentences, results):
 
 def main(args):
     crawler = irc_crawler.IRCCrawler()
+    policy = candc_boxer_api.CCBoxerCallPolicy(timeout=args.boxer_timeout, hedge_after=args.boxer_hedge_after)
+    ccboxer = candc_boxer_api.CCBoxerAPI(offline=args.offline, policy=policy)
     try:
         level = crawler.get_level(args.level_id)
     except irc_crawler.LevelDoesNotExistException:
@@ -38,20 +45,23 @@ def main(args):
     # Or can C&C/Boxer and Cornell AMR parse phrases?
     # sentences = ["Every man loves a woman.", "Every man has a cat."]
     # sentences = level.get_sentences() # This will not work with C&C/Boxer when sentences are long
-    sentences = level.get_sentence_fragments()
+    # sentences = level.get_sentence_fragments()
+    # Long sentences are split at fragment boundaries, semicolons and enumerations; chunks keep the index of their sentence
+    _, chunks = clause_splitter.split_level(level, args.max_tokens)
+    sentences = [chunk for _, chunk in chunks]
 
     if args.representation == "fol":
         try:
-            results = parse_fol(sentences)
+            results = parse_fol(sentences, ccboxer)
         except candc_boxer_api.CCBoxerAPIException:
             print("Warning: C&C/Boxer API Failed. Using AMR parser and AMR to FOL translation instead.")
-            amr_results = parse_amr.parse_amr(sentences, parser="camr")
+            amr_results = parse_amr.parse_amr(sentences, parser="camr", shards=args.amr_shards)
             results = [amr2fol.translate(amr) for amr in amr_results]
     elif args.representation == "amr":
-        results = parse_amr.parse_amr(sentences, parser="camr")
+        results = parse_amr.parse_amr(sentences, parser="camr", shards=args.amr_shards)
     elif args.representation == "amr2fol":
         # CAMR seems to do better than Cornell AMR
-        amr_results = parse_amr.parse_amr(sentences, parser="camr")
+        amr_results = parse_amr.parse_amr(sentences, parser="camr", shards=args.amr_shards)
         results = [amr2fol.translate(amr) for amr in amr_results]
     elif args.representation == "default_logic":
         # TODO #1
@@ -61,7 +71,12 @@ def main(args):
         # TODO #3
         # Need user to specify part of background theory.
         # However, this could actually be done later, when we actually want to "run" the default logic.
-        definitions_as_fol = definition_extractor.fol_definitions(level)
+        global_terms = None
+        if args.global_terms:
+            global_terms = definition_extractor.load_global_terms()
+        elif args.scoped_terms:
+            global_terms = definition_scope.load_definition_scope_index().get_terms(level.id)
+        definitions_as_fol = definition_extractor.fol_definitions(level, global_terms=global_terms)
         background_theory = [Expression.fromstring(d["fol"]) for d in definitions_as_fol]
 
         scope_level_id = level.id.get_section_id()
@@ -84,12 +99,12 @@ def main(args):
             default_rules_sentences = rule_extractor.extract_rules(scope_level)
 
             try:
-                default_rules = [parse_fol(sentences) for sentences in default_rules_sentences]
+                default_rules = [parse_fol(sentences, ccboxer) for sentences in default_rules_sentences]
             except candc_boxer_api.CCBoxerAPIException:
                 print("Warning: C&C/Boxer API Failed. Using AMR parser and AMR to FOL translation instead.")
                 default_rules = []
                 for sentences in default_rules_sentences:
-                    amr_results = parse_amr.parse_amr(sentences, parser="camr")
+                    amr_results = parse_amr.parse_amr(sentences, parser="camr", shards=args.amr_shards)
                     results = [amr2fol.translate(amr) for amr in amr_results]
                     default_rules.extend(results)
 
@@ -127,5 +142,12 @@ if __name__ == "__main__":
     parser.add_argument("--representation", choices=["fol", "amr", "amr2fol", "default_logic"], default="fol")
     parser.add_argument("--output-file", type=str, default="pipeline.out")
     parser.add_argument("--dl-hack", action="store_true", help="Hard-code part of default logic for section 163(h).")
+    parser.add_argument("--max-tokens", type=int, default=clause_splitter.MAX_TOKENS, help="Sentences with more tokens are split into chunks before parsing.")
+    parser.add_argument("--amr-shards", type=int, default=1, help="Number of AMR parser processes to split the sentences across.")
+    parser.add_argument("--boxer-timeout", type=float, default=60.0, help="Seconds before a request to C&C/Boxer is abandoned (and retried).")
+    parser.add_argument("--boxer-hedge-after", type=float, default=None, help="Seconds after which a duplicate of an unanswered C&C/Boxer request is sent.")
+    parser.add_argument("--offline", action="store_true", help="Only use cached C&C/Boxer responses, without contacting the server.")
+    parser.add_argument("--global-terms", action="store_true", help="Include references to terms defined anywhere in the IRC in the background theory.")
+    parser.add_argument("--scoped-terms", action="store_true", help="Include references to terms whose definitions apply at the level (e.g. defined elsewhere in its section) in the background theory.")
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,32 @@
+import json
+import irc_crawler
+
+
+def diff_releases(old_xml_filepath, new_xml_filepath=None):
+    old_crawler = irc_crawler.IRCCrawler(streaming=True, xml_filepath=old_xml_filepath)
+    new_crawler = irc_crawler.IRCCrawler(streaming=True, xml_filepath=new_xml_filepath)
+    return irc_crawler.compare_section_hashes(old_crawler.get_section_hashes(), new_crawler.get_section_hashes())
+
+def main(args):
+    manifest = diff_releases(args.old_xml_filepath, args.new_xml_filepath)
+    for change in ["added", "removed", "changed", "unchanged"]:
+        print("{}: {} sections".format(change.capitalize(), len(manifest[change])))
+    with open(args.output_file, 'w') as f:
+        json.dump(manifest, f, indent=4, encoding="UTF-8")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Find the sections of the Internal Revenue Code that changed between two release points.")
+    parser.add_argument("old_xml_filepath",
+                        type=str,
+                        help="Path to the XML of the previous release point.")
+    parser.add_argument("--new-xml-filepath",
+                        type=str,
+                        default=None,
+                        help="Path to the XML of the new release point (defaults to irc/xml/irc.xml).")
+    parser.add_argument("--output-file",
+                        type=str,
+                        default="release_diff.json")
+    args = parser.parse_args()
+    main(args)
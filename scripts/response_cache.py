@@ -0,0 +1,91 @@
+import os
+from os.path import exists, getsize, join
+import hashlib
+import json
+import threading
+
+
+def cache_key(*parts):
+    # Content address of a request, e.g. the server, its options and the input
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of JSON-serializable responses, one file per key. Files are written with write-then-rename,
+    so several threads or processes can share a cache. Reading an entry marks it as recently used, and once
+    the cache grows over max_bytes the least recently used entries are evicted.
+    """
+    def __init__(self, directory, max_bytes=512 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _filepath(self, key):
+        return join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        filepath = self._filepath(key)
+        try:
+            with open(filepath, 'r') as f:
+                value = json.load(f)
+        except (IOError, ValueError):
+            return None
+        try:
+            os.utime(filepath, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        filepath = self._filepath(key)
+        if not exists(os.path.dirname(filepath)):
+            try:
+                os.makedirs(os.path.dirname(filepath))
+            except OSError:
+                # Made by another thread or process in the meantime
+                pass
+        tmp_filepath = "{0}.{1}.{2}.tmp".format(filepath, os.getpid(), threading.current_thread().ident)
+        with open(tmp_filepath, 'w') as f:
+            json.dump(value, f)
+        size = getsize(tmp_filepath)
+        os.rename(tmp_filepath, filepath)
+        if self.max_bytes is not None:
+            with self._lock:
+                if self._size is None:
+                    self._size = sum(size for _, _, size in self._entries())
+                else:
+                    self._size += size
+                if self._size > self.max_bytes:
+                    self._evict()
+
+    def _entries(self):
+        # (last used, filepath, size) of every entry
+        entries = []
+        if not exists(self.directory):
+            return entries
+        for subdirectory in os.listdir(self.directory):
+            for filename in os.listdir(join(self.directory, subdirectory)):
+                if not filename.endswith(".json"):
+                    continue
+                filepath = join(self.directory, subdirectory, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, filepath, stat.st_size))
+        return entries
+
+    def _evict(self):
+        # Down to 90% of max_bytes, so that eviction does not run on every put
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, filepath, size in entries:
+            if self._size <= 0.9*self.max_bytes:
+                break
+            try:
+                os.remove(filepath)
+            except OSError:
+                continue
+            self._size -= size
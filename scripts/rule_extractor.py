@@ -1,34 +1,119 @@
 import re
-from irc_crawler import IRCCrawler
+import irc_cache
+from irc_crawler import IRCCrawler, LevelId
 from collections import OrderedDict
 
 
+ONLY_LETTERS_REGEX = re.compile("[^a-zA-Z]+", re.UNICODE)
+# Normalized heading => rule type, more can be added for other kinds of rules
+RULE_HEADINGS = OrderedDict([
+    ("generalrule", "general-rule"),
+    ("exceptions", "exceptions"),
+    ("specialrules", "special-rules")
+])
+# Headings of each section, reused for unchanged sections when the index is built for a new release point
+# (while this module is the same)
+SECTION_HEADINGS_RESULTS_FILENAME = "heading_index_results-{0}.pkl"
+
+
 def only_letters(text):
-    pattern = re.compile("[^a-zA-Z]+", re.UNICODE)
-    return pattern.sub("", text)
+    return ONLY_LETTERS_REGEX.sub("", text)
 
-def extract_rules(level):
+def normalize_heading(heading):
+    return only_letters(heading).lower()
+
+def extract_rules(level, rule_headings=RULE_HEADINGS):
     rules = OrderedDict()
     for slevel in level.preorder_transversal():
         if slevel.heading is None:
             continue
-        heading = only_letters(slevel.heading).lower()
-        level_rules = OrderedDict()
-        if heading == "generalrule":
-            level_rules["general-rule"] = slevel.get_sentences()
-        elif heading == "exceptions":
-            level_rules["exceptions"] = slevel.get_sentences()
-        elif heading == "specialrules":
-            level_rules["special-rules"] = slevel.get_sentences()
-        if len(level_rules) > 0:
-            rules[slevel.id.val] = level_rules
+        heading = normalize_heading(slevel.heading)
+        if heading in rule_headings:
+            rules[slevel.id.val] = OrderedDict([(rule_headings[heading], slevel.get_sentences())])
     return rules
 
-def main(args):
-    crawler = IRCCrawler()
-    level = crawler.get_level(args.level_id)
+def get_section_headings(section):
+    # Number of levels of the section, and (position in the section, level id, normalized heading) of those with a heading
+    headings = []
+    level_count = 0
+    for level in section.preorder_transversal():
+        if level.heading is not None:
+            headings.append((level_count, level.id.val, normalize_heading(level.heading)))
+        level_count += 1
+    return level_count, headings
+
+
+class HeadingIndex(object):
+    """
+    Levels of the whole IRC by normalized heading, so that rules are found without walking every level.
+    """
+    def __init__(self, headings):
+        # Normalized heading => section id => [(position in document order, level id)]
+        self.headings = headings
+
+    @staticmethod
+    def build(crawler=None, processes=None, reuse_results=True):
+        # Built from the headings of each section, which are only extracted again for changed sections
+        if crawler is None:
+            crawler = IRCCrawler(streaming=True, compact=True)
+        headings = dict()
+        section_start = 0
+        section_headings = crawler.map_sections(get_section_headings,
+                                                processes=processes,
+                                                results_filename=SECTION_HEADINGS_RESULTS_FILENAME.format(irc_cache.code_hash(__file__)),
+                                                reuse_results=reuse_results)
+        for level_count, levels in section_headings:
+            for position, level_id, heading in levels:
+                section_id = LevelId(level_id).get_section_id()
+                headings.setdefault(heading, dict()).setdefault(section_id, []).append((section_start + position, level_id))
+            section_start += level_count
+        return headings
 
-    rules = extract_rules(level)
+    def find(self, normalized_headings, scope_level_id=None):
+        # (level id, normalized heading) of levels with the headings, in document order, optionally within a level
+        found = []
+        scope = unicode(scope_level_id) if scope_level_id is not None else None
+        for heading in normalized_headings:
+            sections = self.headings.get(heading, dict())
+            if scope is not None:
+                section_id = LevelId(scope).get_section_id()
+                sections = {section_id: sections.get(section_id, [])}
+            for section_levels in sections.values():
+                for position, level_id in section_levels:
+                    if scope is None or level_id == scope or level_id.startswith(scope + u"/"):
+                        found.append((position, level_id, heading))
+        return [(level_id, heading) for _, level_id, heading in sorted(found)]
+
+
+def load_heading_index(crawler=None, rebuild=False, processes=None):
+    if crawler is None:
+        crawler = IRCCrawler(streaming=True, compact=True)
+    source_hash = irc_cache.file_hash(crawler.xml_filepath)
+    index_filename = "heading_index-{0}-{1}.pkl".format(source_hash, irc_cache.code_hash(__file__))
+    headings = None if rebuild else irc_cache.load_pickle(index_filename)
+    if headings is None:
+        headings = HeadingIndex.build(crawler, processes=processes, reuse_results=not rebuild)
+        irc_cache.dump_pickle(index_filename, headings)
+    return HeadingIndex(headings)
+
+def lookup_rules(scope_level_id=None, rule_headings=RULE_HEADINGS, crawler=None, heading_index=None):
+    """
+    Same as extract_rules for the level with the given id (or for the whole IRC if None), as a heading
+    index lookup followed by fetching the sentences of the levels found.
+    """
+    if crawler is None:
+        crawler = IRCCrawler(streaming=True, compact=True)
+    if heading_index is None:
+        heading_index = load_heading_index(crawler)
+    found = heading_index.find(rule_headings.keys(), scope_level_id)
+    levels = crawler.get_levels([level_id for level_id, _ in found])
+    rules = OrderedDict()
+    for (level_id, heading), level in zip(found, levels):
+        rules[level_id] = OrderedDict([(rule_headings[heading], level.get_sentences())])
+    return rules
+
+def main(args):
+    rules = lookup_rules(args.level_id)
     if len(rules) == 0:
         print("Info: No rules found.")
         return
@@ -1,6 +1,7 @@
 import os
 from os.path import join, splitext
 import json
+from .. import irc_cache
 from .. import irc_crawler
 from .. import definition_extractor
 from nltk.tokenize import word_tokenize
@@ -9,14 +10,25 @@ import math
 import matplotlib.pyplot as plt
 
 
-def dump_definitions(defined_terms_filename, definitions_filename):
+# Definitions extracted per section, reused for unchanged sections on later runs (while the extraction code is the same)
+RESULTS_FILENAME = "definition_stats_results-{0}.pkl"
+
+
+def extract_section_definitions(section):
+    defined_terms, definitions = definition_extractor.extract_definitions(section)
+    return section.id.val, defined_terms, definitions
+
+def dump_definitions(defined_terms_filename, definitions_filename, processes=None, reuse_results=True):
     all_definitions = dict()
-    crawler = irc_crawler.IRCCrawler()
-    for section in crawler.iterate_over_sections():
-        defined_terms, definitions = definition_extractor.extract_definitions(section)
+    crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+    section_definitions = crawler.map_sections(extract_section_definitions,
+                                               processes=processes,
+                                               results_filename=RESULTS_FILENAME.format(irc_cache.code_hash(__file__, definition_extractor.__file__)),
+                                               reuse_results=reuse_results)
+    for section_id, defined_terms, definitions in section_definitions:
         if len(defined_terms) == 0:
             continue
-        all_definitions[section.id.val] = definitions
+        all_definitions[section_id] = definitions
         with open(defined_terms_filename, 'a') as f:
             for term in defined_terms:
                 f.write(u"{}\n".format(term).encode("UTF-8"))
@@ -109,7 +121,7 @@ def main(args):
     persection_definition_stats_filename = join(args.output_dir, "persection_definition_stats.json")
     overall_definition_stats_filename = join(args.output_dir, "overall_definition_stats.json")
 
-    all_definitions = dump_definitions(defined_terms_filename, definitions_filename)
+    all_definitions = dump_definitions(defined_terms_filename, definitions_filename, processes=args.processes, reuse_results=not args.recompute)
 
     dump_stats(all_definitions, persection_definition_stats_filename, overall_definition_stats_filename)
 
@@ -126,5 +138,12 @@ if __name__ == "__main__":
     parser.add_argument("--plot-sections",
                         action="store_true",
                         help="Generate plot for each section for token counts over definitions.")
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of processes to extract definitions with (defaults to the number of cores).")
+    parser.add_argument("--recompute",
+                        action="store_true",
+                        help="Extract definitions from all sections, instead of reusing results for unchanged sections.")
     args = parser.parse_args()
     main(args)
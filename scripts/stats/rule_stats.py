@@ -1,6 +1,7 @@
 import os
 from os.path import join, splitext
 import json
+from collections import OrderedDict
 from .. import irc_crawler
 from .. import rule_extractor
 from nltk.tokenize import word_tokenize
@@ -9,14 +10,14 @@ import math
 import matplotlib.pyplot as plt
 
 
-def dump_rules(rules_filename):
+def dump_rules(rules_filename, processes=None, reuse_index=True):
     all_rules = dict()
-    crawler = irc_crawler.IRCCrawler()
-    for section in crawler.iterate_over_sections():
-        rules = rule_extractor.extract_rules(section)
-        if len(rules) == 0:
-            continue
-        all_rules[section.id.val] = rules
+    crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+    heading_index = rule_extractor.load_heading_index(crawler, rebuild=not reuse_index, processes=processes)
+    rules = rule_extractor.lookup_rules(crawler=crawler, heading_index=heading_index)
+    for level_id, level_rules in rules.items():
+        section_id = irc_crawler.LevelId(level_id).get_section_id()
+        all_rules.setdefault(section_id, OrderedDict())[level_id] = level_rules
     with open(rules_filename, 'w') as f:
         json.dump(all_rules, f, indent=4, sort_keys=True, encoding="UTF-8")
     return all_rules
@@ -130,7 +131,7 @@ def main(args):
     persection_rule_stats_filename = join(args.output_dir, "persection_rule_stats.json")
     overall_rule_stats_filename = join(args.output_dir, "overall_rule_stats.json")
 
-    all_rules = dump_rules(rules_filename)
+    all_rules = dump_rules(rules_filename, processes=args.processes, reuse_index=not args.recompute)
 
     dump_stats(all_rules, persection_rule_stats_filename, overall_rule_stats_filename)
 
@@ -147,5 +148,12 @@ if __name__ == "__main__":
     parser.add_argument("--plot-sections",
                         action="store_true",
                         help="Generate plot for each section for token counts over rules.")
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of processes to extract section headings with (defaults to the number of cores).")
+    parser.add_argument("--recompute",
+                        action="store_true",
+                        help="Rebuild the heading index that rules are looked up in from every section, instead of reusing the cached index and the headings of unchanged sections.")
     args = parser.parse_args()
     main(args)
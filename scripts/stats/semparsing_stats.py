@@ -1,17 +1,22 @@
 import json
 from .. import candc_boxer_api
+from .. import clause_splitter
 from nltk.tokenize import word_tokenize
 
 
-def count_definition_crashes(ccboxer, definitions):
+def count_definition_crashes(ccboxer, definitions, batched=False, max_tokens=None):
     crashed_token_counts = dict()
     total_section_crash_count = 0
     total_num_definitions = 0
     total_num_crashes = 0
-    for section_id in definitions:
+    section_ids = list(definitions)
+    all_sentences = []
+    for section_id in section_ids:
         section_definitions = definitions[section_id]
-        sentences = [section_definitions[term]["sentence"] for term in section_definitions]
-        token_counts = count_crashes(ccboxer, sentences)
+        all_sentences.append([section_definitions[term]["sentence"] for term in section_definitions])
+    # All sentences are sent at once, so that requests for different sections run concurrently
+    all_token_counts = count_crashes_many(ccboxer, all_sentences, batched, max_tokens)
+    for section_id, sentences, token_counts in zip(section_ids, all_sentences, all_token_counts):
         crashed_token_counts[section_id] = token_counts
         if len(token_counts) > 0:
             total_section_crash_count += 1
@@ -23,7 +28,7 @@ def count_definition_crashes(ccboxer, definitions):
     print("Total number of definitions that cause C&C/Boxer crash: {}".format(total_num_crashes))
     return crashed_token_counts
 
-def count_rule_crashes(ccboxer, rules):
+def count_rule_crashes(ccboxer, rules, batched=False, max_tokens=None):
     crashed_token_counts = {
         "general-rule": dict(),
         "exceptions": dict(),
@@ -44,6 +49,8 @@ def count_rule_crashes(ccboxer, rules):
         "exceptions": {"total": 0, "crash": 0},
         "special-rules": {"total": 0, "crash": 0}
     }
+    keys = []
+    all_sentences = []
     for section_id in rules:
         section_rules = {
             "general-rule": [],
@@ -55,15 +62,17 @@ def count_rule_crashes(ccboxer, rules):
             for rule_type in level_rules:
                 section_rules[rule_type].extend(level_rules[rule_type])
         for rule_type in section_rules:
-            sentences = section_rules[rule_type]
-            token_counts = count_crashes(ccboxer, sentences)
-            crashed_token_counts[rule_type][section_id] = token_counts
-            if len(sentences) > 0:
-                total_section_crash_count[rule_type]["total"] += 1
-            if len(token_counts) > 0:
-                total_section_crash_count[rule_type]["crash"] += 1
-            total_num_crashes[rule_type] += len(token_counts)
-            total_num_rules[rule_type] += len(sentences)
+            keys.append((section_id, rule_type))
+            all_sentences.append(section_rules[rule_type])
+    all_token_counts = count_crashes_many(ccboxer, all_sentences, batched, max_tokens)
+    for (section_id, rule_type), sentences, token_counts in zip(keys, all_sentences, all_token_counts):
+        crashed_token_counts[rule_type][section_id] = token_counts
+        if len(sentences) > 0:
+            total_section_crash_count[rule_type]["total"] += 1
+        if len(token_counts) > 0:
+            total_section_crash_count[rule_type]["crash"] += 1
+        total_num_crashes[rule_type] += len(token_counts)
+        total_num_rules[rule_type] += len(sentences)
     for rule_type in total_num_rules:
         print("Total number of sections with rules of type {}: {}".format(rule_type, total_section_crash_count[rule_type]["total"]))
         print("Total number of sections with crashes for rules of type {}: {}".format(rule_type, total_section_crash_count[rule_type]["crash"]))
@@ -73,17 +82,45 @@ def count_rule_crashes(ccboxer, rules):
     print("Total number of rules that cause C&C/Boxer crash: {}".format(sum(total_num_crashes.values())))
     return crashed_token_counts
 
-def count_crashes(ccboxer, sentences):
-    crashed_token_counts = []
-    for sentence in sentences:
-        try:
-            ccboxer.interpret([sentence])
-        except candc_boxer_api.CCBoxerAPIException:
-            crashed_token_counts.append(len(word_tokenize(sentence)))
-    return crashed_token_counts
+def count_crashes(ccboxer, sentences, batched=False, max_tokens=None):
+    return count_crashes_many(ccboxer, [sentences], batched, max_tokens)[0]
+
+def count_crashes_many(ccboxer, sentence_lists, batched=False, max_tokens=None):
+    """
+    Token counts of the sentences that crash C&C/Boxer, for each list of sentences. With max_tokens, sentences
+    are split into chunks first (see clause_splitter.py), and a sentence crashes if any of its chunks does.
+    """
+    all_sentences = [sentence for sentences in sentence_lists for sentence in sentences]
+    if max_tokens is not None:
+        chunks = clause_splitter.split_sentences(all_sentences, max_tokens)
+    else:
+        chunks = list(enumerate(all_sentences))
+    if batched:
+        chunk_results = ccboxer.interpret_batched([chunk for _, chunk in chunks])
+    else:
+        chunk_results = ccboxer.interpret_many([chunk for _, chunk in chunks])
+    # Result of each sentence, the first exception of its chunks if any
+    sentence_results = [None]*len(all_sentences)
+    for (i, _), result in zip(chunks, chunk_results):
+        if not isinstance(sentence_results[i], candc_boxer_api.CCBoxerAPIException):
+            sentence_results[i] = result
+    results = iter(sentence_results)
+    all_crashed_token_counts = []
+    for sentences in sentence_lists:
+        crashed_token_counts = []
+        for sentence in sentences:
+            result = next(results)
+            if isinstance(result, (candc_boxer_api.CCBoxerUnavailableException, candc_boxer_api.CCBoxerCacheMissException)):
+                # Not a crash, the server could not be reached (or, offline, the sentence was never sent)
+                raise result
+            if isinstance(result, candc_boxer_api.CCBoxerAPIException):
+                crashed_token_counts.append(len(word_tokenize(sentence)))
+        all_crashed_token_counts.append(crashed_token_counts)
+    return all_crashed_token_counts
 
 def main(args):
-    ccboxer = candc_boxer_api.CCBoxerAPI()
+    policy = candc_boxer_api.CCBoxerCallPolicy(timeout=args.timeout, hedge_after=args.hedge_after)
+    ccboxer = candc_boxer_api.CCBoxerAPI(concurrency=args.concurrency, offline=args.offline, policy=policy)
     all_crashed_token_counts = dict()
 
     with open(args.definitions_filepath, 'r') as f:
@@ -92,11 +129,11 @@ def main(args):
     with open(args.rules_filepath, 'r') as f:
         rules = json.load(f)
 
-    all_crashed_token_counts["definitions"] = count_definition_crashes(ccboxer, definitions)
+    all_crashed_token_counts["definitions"] = count_definition_crashes(ccboxer, definitions, args.batch, args.max_tokens)
 
     print("*"*25)
 
-    all_crashed_token_counts["rules"] = count_rule_crashes(ccboxer, rules)
+    all_crashed_token_counts["rules"] = count_rule_crashes(ccboxer, rules, args.batch, args.max_tokens)
 
     with open(args.output_file, 'w') as f:
         json.dump(all_crashed_token_counts, f, indent=4, sort_keys=True, encoding="UTF-8")
@@ -115,5 +152,27 @@ if __name__ == "__main__":
     parser.add_argument("--rules-filepath",
                         type=str,
                         default="rule_stats/rules.json")
+    parser.add_argument("--concurrency",
+                        type=int,
+                        default=8,
+                        help="Maximum number of requests to C&C/Boxer in flight at once.")
+    parser.add_argument("--batch",
+                        action="store_true",
+                        help="Send several sentences per request, splitting batches that fail to find the crashing sentences.")
+    parser.add_argument("--max-tokens",
+                        type=int,
+                        default=None,
+                        help="Split sentences with more tokens into chunks before parsing, as pipeline.py does.")
+    parser.add_argument("--timeout",
+                        type=float,
+                        default=60.0,
+                        help="Seconds before a request to C&C/Boxer is abandoned (and retried).")
+    parser.add_argument("--hedge-after",
+                        type=float,
+                        default=None,
+                        help="Seconds after which a duplicate of an unanswered request is sent.")
+    parser.add_argument("--offline",
+                        action="store_true",
+                        help="Only use cached C&C/Boxer responses, without contacting the server.")
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,69 @@
+from collections import deque
+
+
+class TermAutomaton(object):
+    """
+    Aho-Corasick automaton over a set of terms, finding every (possibly overlapping) occurrence
+    of any of the terms in a single pass over a text.
+    """
+    def __init__(self, terms):
+        # State => {character => next state}, state 0 is the root
+        self._goto = [dict()]
+        self._fail = [0]
+        # State => terms ending at this state
+        self._output = [[]]
+        for term in terms:
+            self._add(term)
+        self._build_fail_links()
+
+    def _add(self, term):
+        assert len(term) > 0
+        state = 0
+        for c in term:
+            if c not in self._goto[state]:
+                self._goto.append(dict())
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][c] = len(self._goto) - 1
+            state = self._goto[state][c]
+        if term not in self._output[state]:
+            self._output[state].append(term)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail != 0 and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(c, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text, whole_words=False):
+        # Yields (end index, term) for every occurrence, only those not inside a longer word if whole_words
+        state = 0
+        for i, c in enumerate(text):
+            while state != 0 and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for term in self._output[state]:
+                if whole_words and not _is_whole_word(text, i + 1 - len(term), i + 1):
+                    continue
+                yield i + 1, term
+
+    def find_terms(self, text, whole_words=False):
+        return set(term for _, term in self.find_all(text, whole_words))
+
+
+def _is_word_char(c):
+    return c.isalnum() or c == u"_"
+
+def _is_whole_word(text, start, end):
+    # Same as \b around text[start:end], on the sides where it starts or ends with a word character
+    if _is_word_char(text[start]) and start > 0 and _is_word_char(text[start - 1]):
+        return False
+    if _is_word_char(text[end - 1]) and end < len(text) and _is_word_char(text[end]):
+        return False
+    return True
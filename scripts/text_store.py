@@ -0,0 +1,135 @@
+import mmap
+import irc_cache
+import irc_crawler
+
+
+TEXT_INDEX_FILENAME = "text_index.json"
+
+
+class TextStore(object):
+    """
+    All level text of the IRC in a single memory-mapped UTF-8 file, so processes share the same pages
+    instead of each holding a copy of the corpus. Fragments are separated by a space within a section,
+    and sections by a newline, so the text of any level (its fragments, joined by spaces) is one
+    contiguous slice of the file. Text is only decoded (copied) for the levels it is asked for.
+    """
+    def __init__(self, text_filename, fragment_starts, fragment_ends, levels, sections):
+        # Byte range of each fragment
+        self.fragment_starts = fragment_starts
+        self.fragment_ends = fragment_ends
+        # Level id => [first fragment, end fragment]
+        self.levels = levels
+        # Byte range of each section, in the order iterate_over_sections yields them
+        self.sections = sections
+        with open(irc_cache.cache_filepath(text_filename), 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def build(text_filename, crawler=None):
+        if crawler is None:
+            crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+        fragment_starts = []
+        fragment_ends = []
+        levels = dict()
+        sections = []
+        writer = irc_cache.RecordWriter(text_filename)
+        try:
+            for section in crawler.iterate_over_sections():
+                tree = section.tree
+                base = len(fragment_starts) - tree.fragment_start[section.index]
+                for i in xrange(section.index, tree.end[section.index]):
+                    levels.setdefault(tree.ids[i], [base + tree.fragment_start[i], base + tree.fragment_end[i]])
+                fragments = [fragment.encode("UTF-8") for fragment in section.get_sentence_fragments()]
+                text = b" ".join(fragments)
+                # Offsets follow the bytes written, also for sections without text
+                offset = writer.write_bytes(text + b"\n")
+                sections.append([offset, offset + len(text)])
+                for fragment in fragments:
+                    fragment_starts.append(offset)
+                    fragment_ends.append(offset + len(fragment))
+                    offset += len(fragment) + 1
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+        return fragment_starts, fragment_ends, levels, sections
+
+    def _get_bounds(self, level_id):
+        level_id = unicode(level_id)
+        if level_id not in self.levels:
+            raise irc_crawler.LevelDoesNotExistException()
+        fragment_start, fragment_end = self.levels[level_id]
+        if fragment_start == fragment_end:
+            return 0, 0
+        return self.fragment_starts[fragment_start], self.fragment_ends[fragment_end - 1]
+
+    def get_buffer(self, level_id):
+        # Zero-copy view of the level's UTF-8 text, e.g. for byte-string regexes
+        start, end = self._get_bounds(level_id)
+        return buffer(self._mmap, start, end - start)
+
+    def get_text(self, level_id):
+        start, end = self._get_bounds(level_id)
+        return self._mmap[start:end].decode("UTF-8")
+
+    def get_section_buffer(self, i):
+        # Zero-copy view of the UTF-8 text of the i-th section
+        start, end = self.sections[i]
+        return buffer(self._mmap, start, end - start)
+
+    def get_section_text(self, i):
+        start, end = self.sections[i]
+        return self._mmap[start:end].decode("UTF-8")
+
+    def get_sentence_fragments(self, level_id):
+        level_id = unicode(level_id)
+        if level_id not in self.levels:
+            raise irc_crawler.LevelDoesNotExistException()
+        fragment_start, fragment_end = self.levels[level_id]
+        fragments = []
+        for i in xrange(fragment_start, fragment_end):
+            fragments.append(self._mmap[self.fragment_starts[i]:self.fragment_ends[i]].decode("UTF-8"))
+        return fragments
+
+    def finditer(self, pattern, level_id):
+        # Byte-string patterns run directly on the mapped file; unicode patterns need the level text decoded
+        if isinstance(pattern.pattern, unicode):
+            return pattern.finditer(self.get_text(level_id))
+        return pattern.finditer(self.get_buffer(level_id))
+
+    def close(self):
+        self._mmap.close()
+
+
+def load_text_store(crawler=None):
+    if crawler is None:
+        crawler = irc_crawler.IRCCrawler(streaming=True, compact=True)
+    source_hash = irc_cache.file_hash(crawler.xml_filepath)
+    text_index = irc_cache.load_json(TEXT_INDEX_FILENAME, source_hash)
+    # Indexes without section ranges are from an earlier format
+    if text_index is None or "sections" not in text_index:
+        text_filename = "text-{0}.txt".format(source_hash)
+        # Built from a compact streaming crawler over the same file, since it reads the level tree of each section
+        compact_crawler = irc_crawler.IRCCrawler(streaming=True, compact=True, xml_filepath=crawler.xml_filepath)
+        fragment_starts, fragment_ends, levels, sections = TextStore.build(text_filename, compact_crawler)
+        text_index = {"text": text_filename, "fragment-starts": fragment_starts, "fragment-ends": fragment_ends, "levels": levels, "sections": sections}
+        irc_cache.dump_json(TEXT_INDEX_FILENAME, source_hash, text_index)
+    return TextStore(text_index["text"], text_index["fragment-starts"], text_index["fragment-ends"], text_index["levels"], text_index["sections"])
+
+
+def main(args):
+    text_store = load_text_store()
+    print(text_store.get_text(args.level_id))
+    text_store.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build (if needed) the memory-mapped text store of the Internal Revenue Code, and print the text of a level.")
+    parser.add_argument("--level-id",
+                        type=str,
+                        default="s163/h",
+                        help="Specifies the level (section, subsection, paragraph, etc.) to find. " + \
+                              "Should have pattern s[section]/[subsection]/[paragraph]/[subparagraph]/[clause]/[subclause]/[item]/[subitem]/[subsubitem]. " + \
+                              "For example, 's163/h/1' specifies section 163, subsection h, paragraph 1.")
+    args = parser.parse_args()
+    main(args)
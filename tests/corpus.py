@@ -0,0 +1,51 @@
+# This Python file uses the following encoding: UTF-8
+import os
+from os.path import dirname, join, realpath
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), "scripts"))
+import irc_cache
+import irc_crawler
+
+
+HEADER = u"""<?xml version="1.0" encoding="UTF-8"?>
+<uscDoc xmlns="http://xml.house.gov/schemas/uslm/1.0" identifier="/us/usc/t26">
+<main><title identifier="/us/usc/t26"><num value="26">Title 26</num>
+<subtitle identifier="/us/usc/t26/stA"><num value="A">Subtitle A</num>
+<chapter identifier="/us/usc/t26/stA/ch1"><num value="1">Chapter 1</num>
+"""
+FOOTER = u"""
+</chapter></subtitle></title></main></uscDoc>
+"""
+
+
+def section(num, body, heading=u"Heading"):
+    return u'<section identifier="/us/usc/t26/s{0}"><num value="{0}">§ {0}.</num><heading>{1}</heading>{2}</section>'.format(num, heading, body)
+
+def subsection(section_num, num, content):
+    return u'<subsection identifier="/us/usc/t26/s{0}/{1}"><num value="{1}">({1})</num><content>{2}</content></subsection>'.format(section_num, num, content)
+
+
+class CorpusTestCase(unittest.TestCase):
+    """
+    Runs against a small synthetic irc.xml made of the SECTIONS of the test case, with its own cache directory.
+    """
+    SECTIONS = []
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xml_filepath = join(self.directory, "irc.xml")
+        with open(self.xml_filepath, 'w') as f:
+            f.write((HEADER + u"\n".join(self.SECTIONS) + FOOTER).encode("UTF-8"))
+        self.cache_dir = irc_cache.CACHE_DIR
+        irc_cache.CACHE_DIR = join(self.directory, "cache")
+
+    def tearDown(self):
+        irc_cache.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.directory)
+
+    def make_crawler(self, **kwargs):
+        return irc_crawler.IRCCrawler(xml_filepath=self.xml_filepath, **kwargs)
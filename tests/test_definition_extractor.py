@@ -0,0 +1,32 @@
+# This Python file uses the following encoding: UTF-8
+import unittest
+from corpus import CorpusTestCase, section, subsection
+import definition_extractor
+from term_automaton import TermAutomaton
+
+
+class TermAutomatonTest(unittest.TestCase):
+    def test_whole_words(self):
+        automaton = TermAutomaton([u"tax", u"taxpayer", u"tax year"])
+        text = u"Each taxpayer pays the tax for the tax year."
+        self.assertEqual(automaton.find_terms(text), set([u"tax", u"taxpayer", u"tax year"]))
+        self.assertEqual(automaton.find_terms(u"Each taxpayer pays.", whole_words=True), set([u"taxpayer"]))
+        self.assertEqual(automaton.find_terms(text, whole_words=True), set([u"tax", u"taxpayer", u"tax year"]))
+        self.assertEqual(automaton.find_terms(u"surtax, taxes (tax)", whole_words=True), set([u"tax"]))
+
+
+class TermReferencesTest(CorpusTestCase):
+    SECTIONS = [
+        section(1, subsection(1, u"a", u"For purposes of this section, the term “tax” means a levy.") +
+                   subsection(1, u"b", u"The term “taxpayer” means any person.") +
+                   subsection(1, u"c", u"The term “return” means a statement filed by a taxpayer."))
+    ]
+
+    def test_term_dependencies(self):
+        level = self.make_crawler().get_level(u"s1")
+        self.assertEqual(definition_extractor.term_dependencies(level), [(u"return", u"tax"), (u"return", u"taxpayer")])
+        self.assertEqual(definition_extractor.term_dependencies(level, whole_words=True), [(u"return", u"taxpayer")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+# This Python file uses the following encoding: UTF-8
+import unittest
+from corpus import CorpusTestCase, section, subsection
+import definition_scope
+
+
+class DefinitionScopeTest(CorpusTestCase):
+    SECTIONS = [
+        section(1, subsection(1, u"a", u"Within this chapter, the term “wage” means pay.") + subsection(1, u"b", u"Wages are taxed.")),
+        section(2, subsection(2, u"a", u"For purposes of this chapter, the term “tax” means a levy.") + subsection(2, u"b", u"The tax is due."))
+    ]
+
+    def test_lead_ins(self):
+        self.assertEqual(definition_scope.find_lead_ins(u"In this title, the term “tax” means a levy."), [(0, u"title")])
+        self.assertEqual(definition_scope.find_lead_ins(u"Within this title, the term “tax” means a levy."), [])
+
+    def test_scopes(self):
+        scope_index = definition_scope.load_definition_scope_index(self.make_crawler(streaming=True, compact=True))
+        # "Within this chapter" is not a lead-in, so the definition applies to its section only
+        self.assertEqual(scope_index.get_terms(u"s1/b"), [u"wage", u"tax"])
+        self.assertEqual(scope_index.get_terms(u"s2/b"), [u"tax"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+# This Python file uses the following encoding: UTF-8
+import unittest
+from corpus import CorpusTestCase, section, subsection
+
+
+SECTIONS = [
+    section(1, subsection(1, u"a", u"There is hereby imposed a tax.")),
+    section(2, u"", heading=u"Repealed"),
+    section(3, subsection(3, u"a", u"The tax is due yearly.") + subsection(3, u"b", u"It is paid in dollars."))
+]
+
+
+class LevelLookupTest(CorpusTestCase):
+    SECTIONS = SECTIONS
+
+    def test_parses_only_sections(self):
+        crawler = self.make_crawler(use_cache=False)
+        levels = crawler.get_levels([u"s3/b", u"s1/a", u"s2"])
+        self.assertEqual([level.get_sentences() for level in levels], [[u"It is paid in dollars."], [u"There is hereby imposed a tax."], []])
+        self.assertEqual(crawler.get_level(u"s3").get_sentences(), [u"The tax is due yearly.", u"It is paid in dollars."])
+        # The whole document is never loaded
+        self.assertIsNone(crawler.root)
+
+
+class LevelLookupWithoutRangesTest(CorpusTestCase):
+    # A section tag in a comment, so byte ranges of sections cannot be found and sections are streamed instead
+    SECTIONS = [u"<!-- <section> -->"] + SECTIONS
+
+    def test_parses_only_sections(self):
+        crawler = self.make_crawler(use_cache=False)
+        levels = crawler.get_levels([u"s3/b", u"s1/a", u"s2"])
+        self.assertIsNone(crawler._get_identifier_index()["section-ranges"])
+        self.assertEqual([level.get_sentences() for level in levels], [[u"It is paid in dollars."], [u"There is hereby imposed a tax."], []])
+        self.assertIsNone(crawler.root)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+# This Python file uses the following encoding: UTF-8
+import unittest
+from corpus import CorpusTestCase, section, subsection
+import level_index
+
+
+class LevelIndexTest(CorpusTestCase):
+    SECTIONS = [
+        section(1, subsection(1, u"a", u"There is hereby imposed a tax on income.") + subsection(1, u"b", u"Income tax is due yearly."),
+                heading=u"Tax imposed"),
+        section(2, subsection(2, u"a", u"The tax on the income of a trust."), heading=u"Trusts")
+    ]
+
+    def test_phrase(self):
+        index = level_index.load_level_index(self.make_crawler())
+        self.assertEqual([l.val for l in index.search(u"tax on income")], [u"s1/a"])
+        self.assertEqual([l.val for l in index.search(u"income tax")], [u"s1/b"])
+        self.assertEqual([l.val for l in index.search(u"the income")], [u"s2/a"])
+        self.assertEqual([l.val for l in index.search(u"income yearly")], [])
+
+    def test_heading_only(self):
+        index = level_index.load_level_index(self.make_crawler())
+        self.assertEqual([l.val for l in index.search(u"tax", heading_only=True)], [u"s1"])
+        self.assertEqual([l.val for l in index.search(u"tax", scope_level_id=u"s2")], [u"s2/a"])
+
+    def test_loaded_once(self):
+        crawler = self.make_crawler()
+        self.assertIs(level_index.load_level_index(crawler), level_index.load_level_index(crawler))
+
+
+if __name__ == "__main__":
+    unittest.main()
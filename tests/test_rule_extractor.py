@@ -0,0 +1,52 @@
+# This Python file uses the following encoding: UTF-8
+from os.path import join
+import unittest
+from corpus import CorpusTestCase, HEADER, FOOTER, section
+import irc_crawler
+import rule_extractor
+
+
+def headed_subsection(section_num, num, heading, content):
+    return u'<subsection identifier="/us/usc/t26/s{0}/{1}"><num value="{1}">({1})</num><heading>{2}</heading><content>{3}</content></subsection>'.format(section_num, num, heading, content)
+
+
+class RuleExtractorTest(CorpusTestCase):
+    SECTIONS = [
+        section(1, headed_subsection(1, u"a", u"General rule", u"A tax is imposed.") + headed_subsection(1, u"b", u"Exceptions", u"No tax is imposed on trusts.")),
+        section(2, headed_subsection(2, u"a", u"Special rules", u"The tax is due yearly."))
+    ]
+
+    def test_lookup_rules(self):
+        crawler = self.make_crawler(streaming=True, compact=True)
+        heading_index = rule_extractor.load_heading_index(crawler, processes=1)
+        rules = rule_extractor.lookup_rules(crawler=crawler, heading_index=heading_index)
+        self.assertEqual([(level_id, level_rules.items()) for level_id, level_rules in rules.items()],
+                         [(u"s1/a", [("general-rule", [u"A tax is imposed."])]),
+                          (u"s1/b", [("exceptions", [u"No tax is imposed on trusts."])]),
+                          (u"s2/a", [("special-rules", [u"The tax is due yearly."])])])
+
+    def test_only_changed_sections(self):
+        rule_extractor.load_heading_index(self.make_crawler(streaming=True, compact=True), processes=1)
+        # Next release point, where only section 2 changed
+        xml_filepath = join(self.directory, "irc-next.xml")
+        with open(xml_filepath, 'w') as f:
+            sections = [self.SECTIONS[0], section(2, headed_subsection(2, u"a", u"Exceptions", u"Trusts are exempt."))]
+            f.write((HEADER + u"\n".join(sections) + FOOTER).encode("UTF-8"))
+        processed = []
+        get_section_headings = rule_extractor.get_section_headings
+        def counting_get_section_headings(section):
+            processed.append(section.id.val)
+            return get_section_headings(section)
+        rule_extractor.get_section_headings = counting_get_section_headings
+        try:
+            crawler = irc_crawler.IRCCrawler(streaming=True, compact=True, xml_filepath=xml_filepath)
+            heading_index = rule_extractor.load_heading_index(crawler, processes=1)
+        finally:
+            rule_extractor.get_section_headings = get_section_headings
+        self.assertEqual(processed, [u"s2"])
+        self.assertEqual(heading_index.find(rule_extractor.RULE_HEADINGS.keys()),
+                         [(u"s1/a", "generalrule"), (u"s1/b", "exceptions"), (u"s2/a", "exceptions")])
+
+
+if __name__ == "__main__":
+    unittest.main()
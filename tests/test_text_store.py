@@ -0,0 +1,45 @@
+# This Python file uses the following encoding: UTF-8
+import unittest
+from corpus import CorpusTestCase, section, subsection
+import text_store
+
+
+class TextStoreTest(CorpusTestCase):
+    SECTIONS = [
+        section(1, subsection(1, u"a", u"There is hereby imposed a tax.")),
+        # Reserved section with only a heading, and so no text
+        section(2, u"", heading=u"Reserved"),
+        section(3, subsection(3, u"a", u"The term “tax” means a tax.") + subsection(3, u"b", u"It is due yearly."))
+    ]
+
+    def test_text_after_empty_section(self):
+        crawler = self.make_crawler(streaming=True, compact=True)
+        store = text_store.load_text_store(crawler)
+        self.assertEqual(store.get_text(u"s1"), u"There is hereby imposed a tax.")
+        self.assertEqual(store.get_text(u"s2"), u"")
+        self.assertEqual(store.get_text(u"s3"), u"The term “tax” means a tax. It is due yearly.")
+        self.assertEqual(store.get_text(u"s3/b"), u"It is due yearly.")
+        self.assertEqual(store.get_sentence_fragments(u"s3"), [u"The term “tax” means a tax.", u"It is due yearly."])
+        self.assertEqual([store.get_section_text(i) for i in xrange(len(store.sections))],
+                         [u"There is hereby imposed a tax.", u"", u"The term “tax” means a tax. It is due yearly."])
+        store.close()
+
+    def test_map_section_texts(self):
+        crawler = self.make_crawler(streaming=True, compact=True)
+        results = list(crawler.map_sections(_section_text, processes=1, text=True))
+        self.assertEqual(results, [(u"s1", u"There is hereby imposed a tax."), (u"s2", u""), (u"s3", u"The term “tax” means a tax. It is due yearly.")])
+
+    def test_map_section_texts_with_full_levels(self):
+        # The text store is built on first use, also from a crawler that does not return compact levels
+        crawler = self.make_crawler()
+        results = list(crawler.map_sections(_section_text, processes=1, text=True))
+        self.assertEqual([section_id for section_id, _ in results], [u"s1", u"s2", u"s3"])
+        self.assertEqual(text_store.load_text_store(crawler).get_text(u"s3/a"), u"The term “tax” means a tax.")
+
+
+def _section_text(section_id, text):
+    return section_id, unicode(text, "UTF-8")
+
+
+if __name__ == "__main__":
+    unittest.main()